@@ -6,47 +6,20 @@ import numpy as np
 from PIL import Image, ImageDraw
 import pydicom
 import cv2
+from dcm_window import dcm_to_window_array
 import json
 
 def dcm_to_jpg_array(dcm_path, window_center=-600, window_width=1600):
     """
-    将DICOM文件转换为适合保存的numpy数组
+    将DICOM文件转换为适合保存的numpy数组（查找表实现，见 dcm_window.py）
     Args:
         dcm_path: DICOM文件路径
-        w        # 首先生成JSON文件（如果不存在）
-        json_path = os.path.join(case_path, "nodule_summary_new.json")
-        if not os.path.exists(json_path):
-            nodules = parse_nodules(xml_file, sopuid_to_filename)
-            clusters = cluster_nodules(nodules, distance_threshold=10)
-            with open(json_path, "w", encoding="utf-8") as f:
-                json.dump(clusters, f, ensure_ascii=False, indent=2)
-        
-        # 使用优化的函数保存蒙版（直接从JSON文件读取）
-        global_index = save_masks_for_unet_optimized(dicom_folder, unet_train_folder, global_index)_center: 窗位
+        window_center: 窗位
         window_width: 窗宽
     Returns:
         numpy array: 处理后的图像数组
     """
-    # 读取 DICOM 文件
-    dcm = pydicom.dcmread(dcm_path)
-    # 获取像素数据
-    pixel_data = dcm.pixel_array.astype(np.float32)
-    # 获取 DICOM 文件中的斜率和截距
-    slope = dcm.RescaleSlope if hasattr(dcm, 'RescaleSlope') else 1
-    intercept = dcm.RescaleIntercept if hasattr(dcm, 'RescaleIntercept') else 0
-    # 应用斜率和截距进行线性变换
-    hu = pixel_data * slope + intercept
-
-    # 计算窗位和窗宽的上下限
-    window_min = window_center - window_width / 2
-    window_max = window_center + window_width / 2
-
-    # 进行窗宽窗位的调整
-    windowed = np.clip(hu, window_min, window_max)
-    # 归一化到 0-255 范围
-    windowed = ((windowed - window_min) / (window_max - window_min) * 255).astype(np.uint8)
-    
-    return windowed
+    return dcm_to_window_array(dcm_path, window_center, window_width)
 
 def build_sopuid_to_filename_map(dicom_folder):
     sopuid_to_filename = {}
@@ -6,10 +6,11 @@ import numpy as np
 from PIL import Image, ImageDraw
 import pydicom
 import cv2
+from dcm_window import dcm_to_window_array
 
 def dcm_to_jpg_array(dcm_path, window_center=-600, window_width=1600):
     """
-    将DICOM文件转换为适合保存的numpy数组
+    将DICOM文件转换为适合保存的numpy数组（查找表实现，见 dcm_window.py）
     Args:
         dcm_path: DICOM文件路径
         window_center: 窗位
@@ -17,26 +18,7 @@ def dcm_to_jpg_array(dcm_path, window_center=-600, window_width=1600):
     Returns:
         numpy array: 处理后的图像数组
     """
-    # 读取 DICOM 文件
-    dcm = pydicom.dcmread(dcm_path)
-    # 获取像素数据
-    pixel_data = dcm.pixel_array.astype(np.float32)
-    # 获取 DICOM 文件中的斜率和截距
-    slope = dcm.RescaleSlope if hasattr(dcm, 'RescaleSlope') else 1
-    intercept = dcm.RescaleIntercept if hasattr(dcm, 'RescaleIntercept') else 0
-    # 应用斜率和截距进行线性变换
-    hu = pixel_data * slope + intercept
-
-    # 计算窗位和窗宽的上下限
-    window_min = window_center - window_width / 2
-    window_max = window_center + window_width / 2
-
-    # 进行窗宽窗位的调整
-    windowed = np.clip(hu, window_min, window_max)
-    # 归一化到 0-255 范围
-    windowed = ((windowed - window_min) / (window_max - window_min) * 255).astype(np.uint8)
-    
-    return windowed
+    return dcm_to_window_array(dcm_path, window_center, window_width)
 
 def build_sopuid_to_filename_map(dicom_folder):
     sopuid_to_filename = {}
@@ -5,17 +5,10 @@ from PIL import Image, ImageDraw
 from collections import defaultdict
 import numpy as np
 import time
+from dcm_window import dcm_to_window_array
 
 def dcm_to_pil_image(dcm_path, window_center=-600, window_width=1600):
-    dcm = pydicom.dcmread(dcm_path)
-    pixel_data = dcm.pixel_array.astype(np.float32)
-    slope = getattr(dcm, 'RescaleSlope', 1)
-    intercept = getattr(dcm, 'RescaleIntercept', 0)
-    hu = pixel_data * slope + intercept
-    window_min = window_center - window_width / 2
-    window_max = window_center + window_width / 2
-    windowed = np.clip(hu, window_min, window_max)
-    windowed = ((windowed - window_min) / (window_max - window_min) * 255).astype(np.uint8)
+    windowed = dcm_to_window_array(dcm_path, window_center, window_width)
     return Image.fromarray(windowed).convert("RGB")
 
 def draw_nodules_on_image(dicom_path, centers, output_path, window_center=-600, window_width=1600):
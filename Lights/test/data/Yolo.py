@@ -3,17 +3,12 @@ import json
 import pydicom
 import numpy as np
 import cv2
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dcm_window import dcm_to_window_array
 
 def dcm_to_jpg(dcm_path, jpg_path, window_center=-600, window_width=1600):
-    dcm = pydicom.dcmread(dcm_path)
-    pixel_data = dcm.pixel_array.astype(np.float32)
-    slope = getattr(dcm, 'RescaleSlope', 1)
-    intercept = getattr(dcm, 'RescaleIntercept', 0)
-    hu = pixel_data * slope + intercept
-    window_min = window_center - window_width / 2
-    window_max = window_center + window_width / 2
-    windowed = np.clip(hu, window_min, window_max)
-    windowed = ((windowed - window_min) / (window_max - window_min) * 255).astype(np.uint8)
+    windowed = dcm_to_window_array(dcm_path, window_center, window_width)
     cv2.imwrite(jpg_path, windowed)
     return windowed.shape  # 返回图片尺寸
 
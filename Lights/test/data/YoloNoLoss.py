@@ -3,17 +3,13 @@ import json
 import pydicom
 import numpy as np
 import cv2
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dcm_window import dcm_to_uint16_array
 
 def dcm_to_png_16bit(dcm_path, png_path):
-    dcm = pydicom.dcmread(dcm_path)
-    pixel_data = dcm.pixel_array.astype(np.float32)
-    slope = getattr(dcm, 'RescaleSlope', 1)
-    intercept = getattr(dcm, 'RescaleIntercept', 0)
-    hu = pixel_data * slope + intercept
     # 归一化到 0~65535
-    hu_min = np.min(hu)
-    hu_max = np.max(hu)
-    hu_norm = ((hu - hu_min) / (hu_max - hu_min) * 65535).astype(np.uint16)
+    hu_norm = dcm_to_uint16_array(dcm_path)
     cv2.imwrite(png_path, hu_norm)
     return hu_norm.shape  # 返回图片尺寸
 
@@ -1,24 +1,18 @@
 import os
-import pydicom
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from utils.dicom_catalog import DicomCatalog
 
 dicom_folder = r"D:\MyFile\LIDC-IDRI\LIDC-IDRI-0017"
 target_uid = "1.3.6.1.4.1.14519.5.2.1.6279.6001.305973183883758685859912046949"
 
-found = False
-for root, dirs, files in os.walk(dicom_folder):
-    for file in files:
-        if file.lower().endswith('.dcm'):
-            file_path = os.path.join(root, file)
-            try:
-                ds = pydicom.dcmread(file_path, stop_before_pixels=True)
-                if ds.SOPInstanceUID == target_uid:
-                    print(f"找到文件: {file}")
-                    found = True
-                    break
-            except Exception:
-                continue
-    if found:
-        break
+# 增量扫描后按 SOP UID 查询，重复运行时只读取新增或改动过的文件
+catalog = DicomCatalog(os.path.join(dicom_folder, "dicom_catalog.sqlite"))
+catalog.scan(dicom_folder)
+file_path = catalog.path_of(target_uid, dicom_folder)
 
-if not found:
-    print("未找到对应的DICOM文件。")
\ No newline at end of file
+if file_path is not None:
+    print(f"找到文件: {os.path.basename(file_path)}")
+else:
+    print("未找到对应的DICOM文件。")
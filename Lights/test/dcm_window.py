@@ -0,0 +1,94 @@
+import numpy as np
+import pydicom
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+# 以前 Unetprocess*.py、center.py、data/DcmToJpg.py、data/Yolo.py、data/YoloNoLoss.py 各自复制了一份
+# “转 float32 -> 斜率截距 -> 裁剪 -> 归一化”的逐像素运算。
+# 这里对每个 (像素类型, 斜率, 截距, 窗口) 预先算好查找表，转换时只需一次向量化的查表。
+
+
+@lru_cache(maxsize=256)
+def window_lut(dtype_str, slope, intercept, window_min, window_max, out_max=255, out_dtype_str="uint8"):
+    """
+    返回查找表：下标为像素的存储值（按无符号整数解释），值为窗口化之后的灰度。
+    表中每一项的计算方式与原来逐像素的 float32 运算完全一致，因此结果逐位相同。
+    """
+    dtype = np.dtype(dtype_str)
+    unsigned = np.dtype(f"uint{dtype.itemsize * 8}")
+    codes = np.arange(2 ** (dtype.itemsize * 8), dtype=unsigned).view(dtype)
+
+    hu = codes.astype(np.float32) * slope + intercept
+    windowed = np.clip(hu, window_min, window_max)
+    lut = ((windowed - window_min) / (window_max - window_min) * out_max).astype(out_dtype_str)
+    lut.setflags(write=False)
+    return lut
+
+
+def apply_window(pixels, slope, intercept, window_min, window_max, out_max=255, out_dtype=np.uint8):
+    """
+    对像素数组（单层或整个序列均可）做斜率截距变换和窗口化。
+    8/16 位整数像素走查找表，其它类型退回逐像素的 float32 运算。
+    """
+    pixels = np.asarray(pixels)
+    out_dtype_str = np.dtype(out_dtype).name
+    if pixels.dtype.kind in "iu" and pixels.dtype.itemsize <= 2:
+        lut = window_lut(pixels.dtype.str, float(slope), float(intercept), float(window_min), float(window_max),
+                         out_max, out_dtype_str)
+        unsigned = np.dtype(f"uint{pixels.dtype.itemsize * 8}")
+        return np.take(lut, pixels.view(unsigned))
+
+    hu = pixels.astype(np.float32) * float(slope) + float(intercept)
+    windowed = np.clip(hu, window_min, window_max)
+    return ((windowed - window_min) / (window_max - window_min) * out_max).astype(out_dtype_str)
+
+
+def rescale_params(dcm):
+    """DICOM 中的斜率和截距，缺省为 1 和 0"""
+    return float(getattr(dcm, 'RescaleSlope', 1)), float(getattr(dcm, 'RescaleIntercept', 0))
+
+
+def window_bounds(window_center, window_width):
+    return window_center - window_width / 2, window_center + window_width / 2
+
+
+def dcm_to_window_array(dcm_path, window_center=-600, window_width=1600):
+    """读取单个 DICOM，返回窗口化后的 uint8 数组"""
+    dcm = pydicom.dcmread(dcm_path)
+    slope, intercept = rescale_params(dcm)
+    window_min, window_max = window_bounds(window_center, window_width)
+    return apply_window(dcm.pixel_array, slope, intercept, window_min, window_max)
+
+
+def dcm_to_uint16_array(dcm_path):
+    """读取单个 DICOM，按该层 HU 的最小/最大值归一化到 0~65535 的 uint16 数组"""
+    dcm = pydicom.dcmread(dcm_path)
+    pixels = dcm.pixel_array
+    slope, intercept = rescale_params(dcm)
+    # 斜率为正时 HU 的最值就是存储值最值对应的 HU，无需先把整层转成 float
+    ends = np.array([pixels.min(), pixels.max()]).astype(np.float32) * slope + intercept
+    hu_min, hu_max = float(ends.min()), float(ends.max())
+    return apply_window(pixels, slope, intercept, hu_min, hu_max, out_max=65535, out_dtype=np.uint16)
+
+
+def window_series(dcm_paths, window_center=-600, window_width=1600, max_workers=None):
+    """
+    批量接口：多线程读取并解码一组 DICOM（同一序列，尺寸相同），
+    返回 [n, y, x] 的 uint8 数组，第 i 层对应 dcm_paths[i]。
+    同一序列的斜率截距通常相同，查找表只会计算一次。
+    """
+    window_min, window_max = window_bounds(window_center, window_width)
+    if not dcm_paths:
+        return np.zeros((0, 0, 0), dtype=np.uint8)
+
+    first = pydicom.dcmread(dcm_paths[0])
+    out = np.empty((len(dcm_paths),) + first.pixel_array.shape, dtype=np.uint8)
+
+    def convert(i):
+        dcm = first if i == 0 else pydicom.dcmread(dcm_paths[i])
+        slope, intercept = rescale_params(dcm)
+        out[i] = apply_window(dcm.pixel_array, slope, intercept, window_min, window_max)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(convert, range(len(dcm_paths))))
+    return out
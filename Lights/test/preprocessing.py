@@ -1,9 +1,13 @@
 import os
+import sys
 import xml.etree.ElementTree as ET
 import json
 import math
 
-def build_sopuid_to_filename_map(dicom_folder):
+def build_sopuid_to_filename_map(dicom_folder, catalog=None):
+    # 有 DicomCatalog（已 scan 过）时直接查询，不再遍历目录读文件
+    if catalog is not None:
+        return catalog.sop_to_filename(dicom_folder)
     sopuid_to_filename = {}
     for root, dirs, files in os.walk(dicom_folder):
         for f in files:
@@ -111,8 +115,14 @@ def cluster_nodules(nodules, distance_threshold=30):
     return clusters
 
 if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+    from utils.dicom_catalog import DicomCatalog
+
     a = 1
     root_dir = r"D:\MyFile\LIDC-IDRI"
+    # 整个数据集只增量扫描一次，之后每个病例都是查询
+    catalog = DicomCatalog(os.path.join(root_dir, "dicom_catalog.sqlite"))
+    catalog.scan(root_dir)
     for case_folder in os.listdir(root_dir):
         # 跳过前1006个文件夹
         if a <= 950:
@@ -124,7 +134,7 @@ if __name__ == "__main__":
         print(f"处理: {case_folder}")
         # 查找DICOM和XML
         dicom_folder = case_path
-        sopuid_to_filename = build_sopuid_to_filename_map(dicom_folder)
+        sopuid_to_filename = build_sopuid_to_filename_map(dicom_folder, catalog)
         xml_file = None
         for root, dirs, files in os.walk(case_path):
             for f in files:
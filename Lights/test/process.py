@@ -1,4 +1,5 @@
 import os
+import sys
 import xml.etree.ElementTree as ET
 import pydicom
 from PIL import Image, ImageDraw
@@ -32,7 +33,14 @@ def parse_xml(xml_file):
             })
     return nodules
 
-def find_dicom_file(dicom_folder, sop_uid):
+def find_dicom_file(dicom_folder, sop_uid, catalog=None):
+    # 有 DicomCatalog（已 scan 过）时按 SOP UID 直接查询，只读取匹配的那一个文件
+    if catalog is not None:
+        path = catalog.path_of(sop_uid, dicom_folder)
+        if path is None:
+            return None
+        print(f"找到匹配的 DICOM 文件: {os.path.basename(path)} (SOP UID: {sop_uid})")
+        return pydicom.dcmread(path)
     for file_name in os.listdir(dicom_folder):
         if file_name.endswith('.dcm'):
             dicom_file = pydicom.dcmread(os.path.join(dicom_folder, file_name))
@@ -59,7 +67,7 @@ def draw_contours_on_image(dicom_file, edge_maps, output_path):
                 draw.line((x1, y1, x2, y2), fill=color, width=2)
     image.save(output_path)
 
-def process_nodules(xml_file, dicom_folder, output_folder):
+def process_nodules(xml_file, dicom_folder, output_folder, catalog=None):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
     nodules = parse_xml(xml_file)
@@ -71,7 +79,7 @@ def process_nodules(xml_file, dicom_folder, output_folder):
     for nodule in nodules:
         nodule_groups[nodule["imageSOP_UID"]].append((nodule["edgeMap"], nodule["doctor_id"]))
     for idx, (sop_uid, edge_maps) in enumerate(nodule_groups.items(), 1):
-        dicom_file = find_dicom_file(dicom_folder, sop_uid)
+        dicom_file = find_dicom_file(dicom_folder, sop_uid, catalog)
         if dicom_file is None:
             print(f"未找到与 SOP UID {sop_uid} 匹配的 DICOM 文件")
             continue
@@ -80,6 +88,9 @@ def process_nodules(xml_file, dicom_folder, output_folder):
         print(f"已保存图片 {output_path}，包含 {len(edge_maps)} 个结节")
 
 if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+    from utils.dicom_catalog import DicomCatalog
+
     dicom_folder = r"D:\MyFile\LIDC-IDRI\LIDC-IDRI-0001"
     output_folder = "nodule_contours"
     xml_files = [f for f in os.listdir(dicom_folder) if f.lower().endswith('.xml')]
@@ -87,4 +98,6 @@ if __name__ == "__main__":
         raise FileNotFoundError("DICOM 文件夹中必须且只能有一个 .xml 文件")
     xml_file = os.path.join(dicom_folder, xml_files[0])
     print(f"找到 XML 文件: {xml_file}")
-    process_nodules(xml_file, dicom_folder, output_folder)
\ No newline at end of file
+    catalog = DicomCatalog(os.path.join(dicom_folder, "dicom_catalog.sqlite"))
+    catalog.scan(dicom_folder)
+    process_nodules(xml_file, dicom_folder, output_folder, catalog)
\ No newline at end of file
@@ -37,6 +37,9 @@ data_config = {
     'bbox_border': 8,
     'pad_value': 170,
     # 'jitter_range': [0, 0, 0],
+
+    # number of threads for SimpleITK filters during preprocessing (SimpleITK's default may be 1)
+    'sitk_num_threads': os.cpu_count(),
 }
 
 
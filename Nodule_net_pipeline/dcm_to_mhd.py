@@ -1,20 +1,164 @@
 import os
+import json
+import importlib.util
+import time
 import SimpleITK as sitk
 import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+def select_dcm_series(dcm_folder, preferred_modality="CT"):
+    """
+    枚举文件夹中的所有序列（GetGDCMSeriesIDs），每个序列只读取第一个文件的头信息，
+    按 (是否为 preferred_modality, 层数) 排序选出要转换的序列，其余序列的像素不会被解码。
+    返回 (series_id, dicom_names)。
+    """
+    reader = sitk.ImageSeriesReader()
+    series_ids = reader.GetGDCMSeriesIDs(dcm_folder)
+    if not series_ids:
+        raise ValueError(f"文件夹中没有 DICOM 序列：{dcm_folder}")
+
+    candidates = []
+    for series_id in series_ids:
+        dicom_names = reader.GetGDCMSeriesFileNames(dcm_folder, series_id)
+        file_reader = sitk.ImageFileReader()
+        file_reader.SetFileName(dicom_names[0])
+        file_reader.ReadImageInformation()
+        modality = file_reader.GetMetaData("0008|0060").strip() if file_reader.HasMetaDataKey("0008|0060") else ""
+        candidates.append((modality == preferred_modality, len(dicom_names), series_id, dicom_names))
+
+    candidates.sort(key=lambda x: (x[0], x[1]), reverse=True)
+    _, _, series_id, dicom_names = candidates[0]
+    return series_id, dicom_names
+
 
 def convert_dcm_to_mhd(dcm_folder, output_path):
     """
     选择一个存有dcm文件的文件夹，整理出outputpath的mhd文件到指定文件路径
     在前端使用的时候，要注意，为了下一个函数的调用，output_path所在的文件夹应该干净
+    文件夹中有多个序列时（例如混有 CXR），只转换 select_dcm_series 选出的 CT 序列
     """
+    _, dicom_names = select_dcm_series(dcm_folder)
+
     reader = sitk.ImageSeriesReader()
-    dicom_names = reader.GetGDCMSeriesFileNames(dcm_folder)
     reader.SetFileNames(dicom_names)
 
     image = reader.Execute()
 
     sitk.WriteImage(image, output_path, useCompression=True)
 
+
+def load_dicom_catalog_class():
+    """
+    本目录下的 utils 包与仓库根目录的 utils 同名，因此按文件路径加载根目录的 utils/dicom_catalog.py。
+    """
+    catalog_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils", "dicom_catalog.py")
+    spec = importlib.util.spec_from_file_location("dicom_catalog", catalog_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.DicomCatalog
+
+
+def plan_patient(catalog, patient_path, patient_id, target_mhd_path, target_xml_path):
+    """
+    只根据 catalog 中的头信息为一个病人选出层数最多的序列，返回转换任务；
+    不满足条件时返回 None 并打印原因。
+    """
+    # 该病人所有序列，按层数从多到少排序
+    series_info = catalog.series_in(patient_path)
+    if not series_info:
+        print(f"病人不包含任何有效study：{patient_id}")
+        return None
+    if series_info[0]["count"]<10:
+        print(f"病人的study疑似过短：{patient_id}")
+        return None
+
+    study_original_path = series_info[0]["folder"]
+    study_original_xml_path = None
+    for file in os.listdir(study_original_path):
+        if os.path.isfile(os.path.join(study_original_path,file)) and file.endswith(".xml"):
+            study_original_xml_path = os.path.join(study_original_path,file)
+    if not study_original_xml_path:
+        print(f"病人的最长study没有xml：{study_original_path}")
+        return None
+
+    return {"patient_id": patient_id,
+            "dcm_folder": study_original_path,
+            "xml_path": study_original_xml_path,
+            "target_xml_path": os.path.join(target_xml_path, "patient"+patient_id+".xml"),
+            "target_mhd_path": os.path.join(target_mhd_path, "patient"+patient_id+".mhd")}
+
+
+def convert_patient(task):
+    """
+    进程池中执行的单个病人转换：复制标注、转换 mhd。返回 (patient_id, 耗时秒数)。
+    """
+    start = time.perf_counter()
+    # 标注
+    shutil.copy(task["xml_path"], task["target_xml_path"])
+    # 文件夹
+    convert_dcm_to_mhd(task["dcm_folder"], task["target_mhd_path"])
+    return task["patient_id"], time.perf_counter() - start
+
+
+def convert_dataset(base_path, target_mhd_path, target_xml_path, processes=None, manifest_name="manifest.jsonl"):
+    """
+    将整个 LIDC-IDRI 数据集批量转换为 mhd。
+    先增量扫描头信息（DicomCatalog）为每个病人选出最长的序列，再用进程池并行执行 convert_dcm_to_mhd。
+    每完成一个病人就向 target_mhd_path/manifest_name 追加一行记录，重新运行时跳过已完成的病人。
+    返回失败的 patient_id 列表。
+    """
+    if (not os.path.isdir(base_path)) or len(os.listdir(base_path))==0:
+        assert False,"文件夹不对"
+    os.makedirs(target_mhd_path,exist_ok=True)
+    os.makedirs(target_xml_path,exist_ok=True)
+
+    # 已完成的病人
+    manifest_path = os.path.join(target_mhd_path, manifest_name)
+    finished = set()
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            finished = {json.loads(line)["patient_id"] for line in f if line.strip()}
+
+    # 整个数据集只增量扫描一次（只读头信息），之后每个病人都是查询
+    DicomCatalog = load_dicom_catalog_class()
+    with DicomCatalog(os.path.join(target_mhd_path, "dicom_catalog.sqlite")) as catalog:
+        catalog.scan(base_path)
+
+        tasks = []
+        for patient_fold in sorted(os.listdir(base_path)): # 访问病人
+            patient_path = os.path.join(base_path,patient_fold)
+            patient_id = patient_fold[-4:]
+            if not os.path.isdir(patient_path):
+                print(f"病人同等深度路径被访问，但不是文件夹：{patient_path}")
+                continue
+            if patient_id in finished:
+                continue
+            task = plan_patient(catalog, patient_path, patient_id, target_mhd_path, target_xml_path)
+            if task is not None:
+                tasks.append(task)
+
+    print(f"已完成 {len(finished)} 个病人，本次需要转换 {len(tasks)} 个病人")
+    failed = []
+    total_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes) as executor, \
+            open(manifest_path, "a", encoding="utf-8") as manifest:
+        futures = {executor.submit(convert_patient, task): task for task in tasks}
+        for done_count, future in enumerate(as_completed(futures), 1):
+            task = futures[future]
+            try:
+                patient_id, seconds = future.result()
+            except Exception as e:
+                print(f"[{done_count}/{len(tasks)}] 病人 {task['patient_id']} 转换失败：{e}")
+                failed.append(task["patient_id"])
+                continue
+            manifest.write(json.dumps({"patient_id": patient_id, "dcm_folder": task["dcm_folder"],
+                                       "mhd_path": task["target_mhd_path"], "seconds": round(seconds, 2)}) + "\n")
+            manifest.flush()
+            print(f"[{done_count}/{len(tasks)}] 病人 {patient_id} 完成，用时 {seconds:.1f}s")
+
+    print(f"全部完成，总用时 {time.perf_counter() - total_start:.1f}s，失败 {len(failed)} 个：{failed}")
+    return failed
+
 # 示例用法
 # convert_dcm_to_mhd(r'E:\work_files\praticalTraining_cv\LIDC-IDRI\LIDC-IDRI-0001\1.3.6.1.4.1.14519.5.2.1.6279.6001.298806137288633453246975630178\000000', './patient001.mhd')
 if __name__ == "__main__":
@@ -26,55 +170,5 @@ if __name__ == "__main__":
     
     target_mhd_path = "../../MYLIDC/mhd"
     target_xml_path = "../../MYLIDC/xml"
-    os.makedirs(target_mhd_path,exist_ok=True)
-    os.makedirs(target_xml_path,exist_ok=True)
     base_path = "../../LIDC-IDRI"
-
-    if (not os.path.isdir(base_path)) or len(os.listdir(base_path))==0:
-        assert False,"文件夹不对"
-    for patient_fold in os.listdir(base_path): # 访问病人
-        patient_path = os.path.join(base_path,patient_fold)
-        patient_id = patient_fold[-4:]
-        if not os.path.isdir(patient_path): 
-            print(f"病人同等深度路径被访问，但不是文件夹：{patient_path}")
-            continue
-
-        study_info = []
-        for study_fold in os.listdir(patient_path): # 访问片子id
-            study_path = os.path.join(patient_path, study_fold)
-            study_id = study_fold
-            series_folder = os.path.join(study_path, "000000")
-
-            if not os.path.isdir(study_path):
-                print(f"study同等深度路径被访问，但不是文件夹：{study_path}")
-                continue
-            if not os.path.isdir(series_folder):
-                print(f"study同等深度路径被访问，但不包含000000：{series_folder}，")
-                continue
-
-            file_count = len(os.listdir(series_folder))
-            study_info.append((file_count, study_id))
-        
-        study_info.sort(key=lambda x: x[0], reverse=True)
-        if not study_info:
-            print(f"病人不包含任何有效study：{patient_id}")
-            continue
-        elif study_info[0][0]<10:
-            print(f"病人的study疑似过短：{patient_id}")
-            continue
-        else:
-            study_original_path = os.path.join(patient_path, study_info[0][1],'000000')
-            study_target_xml_path = os.path.join(target_xml_path, "patient"+patient_id+".xml")
-            study_target_mhd_path = os.path.join(target_mhd_path, "patient"+patient_id+".mhd")
-            study_original_xml_path = None
-            for file in os.listdir(study_original_path):
-                if os.path.isfile(os.path.join(study_original_path,file)) and file.endswith(".xml"):
-                    study_original_xml_path = os.path.join(study_original_path,file)
-            
-            if not study_original_xml_path:
-                print(f"病人的最长study没有xml：{study_original_path}")
-                continue
-            # 标注
-            shutil.copy(study_original_xml_path,study_target_xml_path)
-            # 文件夹
-            convert_dcm_to_mhd(study_original_path,study_target_mhd_path)
+    convert_dataset(base_path, target_mhd_path, target_xml_path)
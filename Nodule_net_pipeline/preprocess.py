@@ -6,6 +6,7 @@ import SimpleITK as sitk
 from multiprocessing import Pool
 import os
 import nrrd
+from concurrent.futures import ThreadPoolExecutor
 from scipy.ndimage.measurements import label
 # from config import config
 
@@ -25,7 +26,9 @@ def load_itk_image(filename):
 def binarize(image, spacing, intensity_thred=-600, sigma=1.0, area_thred=30.0,
              eccen_thred=0.99, corner_side=10):
     """
-    Binarize the raw 3D CT image slice by slice
+    Binarize the raw 3D CT image slice by slice. All slices are smoothed and
+    labelled in one call; area and eccentricity of each 2D component come
+    from its moments, accumulated with np.bincount.
     image: 3D numpy array of raw HU values from CT series in [z, y, x] order.
     spacing: float * 3, raw CT spacing in [z, y, x] order.
     intensity_thred: float, thredhold for lung and air
@@ -38,7 +41,6 @@ def binarize(image, spacing, intensity_thred=-600, sigma=1.0, area_thred=30.0,
     return: binary mask with the same shape of the image, that only region of
         interest is True.
     """
-    binary_mask = np.zeros(image.shape, dtype=bool)
     side_len = image.shape[1]  # side length of each slice, e.g. 512
 
     # [-side_len/2, side_len/2], e.g. [-255.5, -254.5, ..., 254.5, 255.5]
@@ -54,41 +56,78 @@ def binarize(image, spacing, intensity_thred=-600, sigma=1.0, area_thred=30.0,
     nan_mask = (distance < side_len / 2).astype(float)
     nan_mask[nan_mask == 0] = np.nan  # assing 0 to be np.nan
 
-    # binarize each slice
-    for i in range(image.shape[0]):
-        slice_raw = np.array(image[i]).astype('float32')
-
-        # number of differnet values in the top-left corner
-        num_uniq = len(np.unique(slice_raw[0:corner_side, 0:corner_side]))
-
-        # black corners out-of-scan, make corners nan before Gaussian filtering
-        # (to make corners False in mask)
-        if num_uniq == 1:
-            slice_raw *= nan_mask
-
-        slice_smoothed = scipy.ndimage.gaussian_filter(slice_raw, sigma,
-                                                       truncate=2.0)
-
-        # mask of low-intensity pixels (True = lungs, air)
-        slice_binary = slice_smoothed < intensity_thred
-
-        # get connected componets annoated by label
-        label = measure.label(slice_binary)
-        properties = measure.regionprops(label)
-        label_valid = set()
-
-        for prop in properties:
-            # area of each componets measured in mm
-            area_mm = prop.area * spacing[1] * spacing[2]
-
-            # only include comppents with curtain min area and round enough
-            if area_mm > area_thred and prop.eccentricity < eccen_thred:
-                label_valid.add(prop.label)
-
-        # test each pixel in label is in label_valid or not and add those True
-        # into slice_binary
-        slice_binary = np.in1d(label, list(label_valid)).reshape(label.shape)
-        binary_mask[i] = slice_binary
+    stack = np.array(image).astype('float32')
+
+    # slices whose top-left corner has a single value have black corners
+    # out-of-scan, make corners nan before Gaussian filtering (to make
+    # corners False in mask)
+    corner = stack[:, 0:corner_side, 0:corner_side]
+    single_value = np.all(corner == corner[:, :1, :1], axis=(1, 2))
+    stack[single_value] *= nan_mask
+
+    # smooth every slice in-plane only, all slices at once
+    stack = scipy.ndimage.gaussian_filter(stack, (0, sigma, sigma),
+                                          truncate=2.0)
+
+    # mask of low-intensity pixels (True = lungs, air)
+    binary = stack < intensity_thred
+    del stack
+
+    # 2D components of every slice (8-connectivity, as measure.label), labelled
+    # in one call with a structure that does not connect neighbouring slices
+    struct = np.zeros((3, 3, 3), dtype=bool)
+    struct[1] = True
+    label, num = scipy.ndimage.label(binary, structure=struct)
+
+    # area and second moments of each component, accumulated over horizontal
+    # runs of equal label (far fewer than pixels) with closed-form sums
+    rows = label.reshape(-1, image.shape[2])
+    run_start = np.ones(rows.shape, dtype=bool)
+    np.not_equal(rows[:, 1:], rows[:, :-1], out=run_start[:, 1:])
+    starts = np.flatnonzero(run_start)
+    del run_start
+    lengths = np.diff(np.append(starts, rows.size)).astype(np.float64)
+    run_label = rows.ravel()[starts]
+
+    keep = run_label > 0
+    starts, lengths, run_label = starts[keep], lengths[keep], run_label[keep]
+    run_y = ((starts // image.shape[2]) % image.shape[1]).astype(np.float64)
+    x_first = (starts % image.shape[2]).astype(np.float64)
+    x_last = x_first + lengths - 1
+
+    def square_sum(n):
+        # 0^2 + 1^2 + ... + n^2
+        return n * (n + 1) * (2 * n + 1) / 6
+
+    run_x = lengths * (x_first + x_last) / 2
+    run_xx = square_sum(x_last) - square_sum(x_first - 1)
+
+    area = np.bincount(run_label, weights=lengths, minlength=num + 1)
+    count = np.maximum(area, 1)
+
+    def mean(values):
+        return np.bincount(run_label, weights=values, minlength=num + 1) / count
+
+    y_mean, x_mean = mean(run_y * lengths), mean(run_x)
+    y_var = mean(np.square(run_y) * lengths) - np.square(y_mean)
+    x_var = mean(run_xx) - np.square(x_mean)
+    xy_cov = mean(run_y * run_x) - y_mean * x_mean
+
+    # eigenvalues of the inertia tensor, eccentricity as in regionprops
+    half_trace = (y_var + x_var) / 2
+    root = np.sqrt(np.square((y_var - x_var) / 2) + np.square(xy_cov))
+    l1 = np.maximum(half_trace + root, 0)
+    l2 = np.maximum(half_trace - root, 0)
+    eccentricity = np.sqrt(1 - np.divide(l2, l1, out=np.ones_like(l1),
+                                         where=l1 > 0))
+
+    # only include components with curtain min area and round enough
+    area_mm = area * spacing[1] * spacing[2]
+    label_valid = (area_mm > area_thred) & (eccentricity < eccen_thred)
+    label_valid[0] = False
+
+    # keep pixels whose label is valid, through a lookup table
+    binary_mask = label_valid[label]
 
     return binary_mask
 
@@ -119,11 +158,11 @@ def exclude_corner_middle(label):
                         label[-1, 0, mid],
                         label[-1, -1, mid]])
 
-    for l in corner_label:
-        label[label == l] = 0
-
-    for l in middle_label:
-        label[label == l] = 0
+    # zero those components with one lookup-table gather instead of one
+    # full-volume pass per label
+    lut = np.arange(label.max() + 1, dtype=label.dtype)
+    lut[list(corner_label | middle_label)] = 0
+    np.take(lut, label, out=label)
 
     return label
 
@@ -140,12 +179,12 @@ def volume_filter(label, spacing, vol_min=0.2, vol_max=8.2):
     vol_min: float, min volume of the lung
     vol_max: float, max volume of the lung
     """
-    properties = measure.regionprops(label)
-
-    for prop in properties:
-        if prop.area * spacing.prod() < vol_min * 1e6 or \
-           prop.area * spacing.prod() > vol_max * 1e6:
-            label[label == prop.label] = 0
+    # volume of every component from one bincount, then zero the components
+    # out of range with one lookup-table gather
+    volume = np.bincount(label.ravel()) * np.prod(spacing)
+    lut = np.arange(len(volume), dtype=label.dtype)
+    lut[(volume < vol_min * 1e6) | (volume > vol_max * 1e6)] = 0
+    np.take(lut, label, out=label)
 
     return label
 
@@ -178,32 +217,46 @@ def exclude_air(label, spacing, area_thred=3e3, dist_thred=62):
     distance = np.sqrt(np.square(y) + np.square(x))
     distance_max = np.max(distance)
 
-    # properties of each 3D componet.
-    vols = measure.regionprops(label)
+    # compact ids of the components present, so the per-slice tables only
+    # have one column per component
+    present = np.bincount(label.ravel()) > 0
+    present[0] = False
+    labels_present = np.flatnonzero(present)
+    compact = np.zeros(len(present), dtype=np.intp)
+    compact[labels_present] = np.arange(len(labels_present))
+
+    # measure area and min_dist of every component in each slice, only over
+    # the foreground pixels of the slice
+    # min_distance: distance of closest voxel to center
+    # (else max(distance))
+    slice_count = np.zeros((label.shape[0], len(labels_present)), dtype=np.int64)
+    min_distance = np.full(slice_count.shape, distance_max)
+
+    for i in range(label.shape[0]):
+        foreground = label[i] > 0
+        if not foreground.any():
+            continue
+        ids = compact[label[i][foreground]]
+        slice_count[i] = np.bincount(ids, minlength=len(labels_present))
+        np.minimum.at(min_distance[i], ids, distance[foreground])
+
+    slice_area = slice_count * np.prod(spacing[1:3])
     label_valid = set()
 
-    for vol in vols:
-        # 3D binary matrix, only voxels within label matches vol.label is True
-        single_vol = (label == vol.label)
-
-        # measure area and min_dist for each slice
-        # min_distance: distance of closest voxel to center
-        # (else max(distance))
-        slice_area = np.zeros(label.shape[0])
-        min_distance = np.zeros(label.shape[0])
-
-        for i in range(label.shape[0]):
-            slice_area[i] = np.sum(single_vol[i]) * np.prod(spacing[1:3])
-            min_distance[i] = np.min(single_vol[i] * distance +
-                                     (1 - single_vol[i]) * distance_max)
-
-            # 1. each slice of the component has enough area (> area_thred)
-            # 2. average min-distance-from-center-pixel < dist_thred
-            if np.average([min_distance[i] for i in range(label.shape[0])
-                          if slice_area[i] > area_thred]) < dist_thred:
-                label_valid.add(vol.label)
-
-    binary_mask = np.in1d(label, list(label_valid)).reshape(label.shape)
+    for k, l in enumerate(labels_present):
+        # 1. each slice of the component has enough area (> area_thred)
+        # 2. average min-distance-from-center-pixel < dist_thred
+        # the average is taken over the slices seen so far, so the component
+        # is valid as soon as one such running average is below dist_thred
+        valid_slices = np.flatnonzero(slice_area[:, k] > area_thred)
+        for n in range(1, len(valid_slices) + 1):
+            if np.average(min_distance[valid_slices[:n], k]) < dist_thred:
+                label_valid.add(l)
+                break
+
+    valid_lut = np.zeros(len(present), dtype=bool)
+    valid_lut[list(label_valid)] = True
+    binary_mask = valid_lut[label]
     has_lung = len(label_valid) > 0
 
     return binary_mask, has_lung
@@ -227,12 +280,28 @@ def fill_hole(binary_mask):
                         label[-1, 0, -1],
                         label[-1, -1, 0],
                         label[-1, -1, -1]])
-    binary_mask = ~np.in1d(label, list(corner_label)).reshape(label.shape)
+    corner_lut = np.zeros(label.max() + 1, dtype=bool)
+    corner_lut[list(corner_label)] = True
+    binary_mask = ~corner_lut[label]
 
     return binary_mask
 
 
-def extract_main(binary_mask, cover=0.95):
+def map_slices(function, binary_mask, num_threads=None):
+    """
+    Call function(i) for every axial slice i of binary_mask that has any
+    foreground, on a bounded thread pool. Slices are independent and the
+    skimage/scipy kernels called per slice largely release the GIL; function
+    must only write to slice i of its output.
+    binary_mask: 3D binary numpy array in [z, y, x] order.
+    num_threads: int, max number of threads, None for the executor default.
+    """
+    nonempty = np.flatnonzero(binary_mask.any(axis=(1, 2)))
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        list(executor.map(function, nonempty))
+
+
+def extract_main(binary_mask, cover=0.95, num_threads=None):
     """
     Extract lung without bronchi/trachea. Remove small components
     binary_mask: 3D binary numpy array with the same shape of the image,
@@ -240,11 +309,13 @@ def extract_main(binary_mask, cover=0.95):
         specifical case.
     cover: float, percetange of the total area to keep of each slice, by
         keeping the total connected components
+    num_threads: int, number of threads for the slice-wise part, see
+        map_slices. Empty slices are skipped.
     return: binary mask with the same shape of the image, that only region of
         interest is True. One side of the lung in this specifical case.
     """
 
-    for i in range(binary_mask.shape[0]):
+    def process_slice(i):
         slice_binary = binary_mask[i]
         label = measure.label(slice_binary)
         properties = measure.regionprops(label)
@@ -270,6 +341,8 @@ def extract_main(binary_mask, cover=0.95):
 
         binary_mask[i] = binary_mask[i] & slice_filter
 
+    map_slices(process_slice, binary_mask, num_threads)
+
     label = measure.label(binary_mask)
     properties = measure.regionprops(label)
     properties.sort(key=lambda x: x.area, reverse=True)
@@ -279,17 +352,19 @@ def extract_main(binary_mask, cover=0.95):
     return binary_mask
 
 
-def fill_2d_hole(binary_mask):
+def fill_2d_hole(binary_mask, num_threads=None):
     """
     Fill in holes of binary single lung slicewise.
     binary_mask: 3D binary numpy array with the same shape of the image,
         that only region of interest is True. One side of the lung in this
         specifical case.
+    num_threads: int, number of threads, see map_slices. Empty slices are
+        skipped.
     return: binary mask with the same shape of the image, that only region of
         interest is True. One side of the lung in this specifical case.
     """
 
-    for i in range(binary_mask.shape[0]):
+    def process_slice(i):
         slice_binary = binary_mask[i]
         label = measure.label(slice_binary)
         properties = measure.regionprops(label)
@@ -301,6 +376,8 @@ def fill_2d_hole(binary_mask):
 
         binary_mask[i] = slice_binary
 
+    map_slices(process_slice, binary_mask, num_threads)
+
     return binary_mask
 
 
@@ -308,7 +385,8 @@ def seperate_two_lung(binary_mask, spacing, max_iter=22, max_ratio=4.8):
     """
     Gradually erode binary mask until lungs are in two separate components
     (trachea initially connects them into 1 component) erosions are just used
-    for distance transform to separate full lungs.
+    for distance transform to separate full lungs. All erosions are read off
+    one taxicab distance transform of the mask's bounding box.
     binary_mask: 3D binary numpy array with the same shape of the image,
         that only region of interest is True.
     spacing: float * 3, raw CT spacing in [z, y, x] order.
@@ -319,49 +397,73 @@ def seperate_two_lung(binary_mask, spacing, max_iter=22, max_ratio=4.8):
         side of the lung.
     """
     found = False
-    iter_count = 0
-    binary_mask_full = np.copy(binary_mask)
 
-    while not found and iter_count < max_iter:
-        label = measure.label(binary_mask, connectivity=2)
-        properties = measure.regionprops(label)
-        # sort componets based on their area
-        properties.sort(key=lambda x: x.area, reverse=True)
-        if len(properties) > 1 and \
-                properties[0].area / properties[1].area < max_ratio:
-            found = True
-            # binnary mask for the larger eroded lung
-            eroded1 = (label == properties[0].label)
-            # binnary mask for the smaller eroded lung
-            eroded2 = (label == properties[1].label)
-        else:
-            # erode the convex hull of each 3D component by 1 voxel
-            binary_mask = scipy.ndimage.binary_erosion(binary_mask)
-            iter_count += 1
+    # everything happens inside the bounding box of the mask
+    box = scipy.ndimage.find_objects(binary_mask.astype(np.uint8))
+    box = box[0] if box else None
+
+    if box is not None:
+        crop = binary_mask[box]
+        # eroding k times with the 6-connected structure of binary_erosion is
+        # the same as keeping voxels whose taxicab distance to the background
+        # is > k; the zero padding plays the role of the erosion border.
+        depth = scipy.ndimage.distance_transform_cdt(np.pad(crop, 1),
+                                                     metric='taxicab')
+        depth = depth[1:-1, 1:-1, 1:-1]
+
+        def separated(k):
+            """two largest components after eroding by k, or None"""
+            label = measure.label(depth > k, connectivity=2)
+            properties = measure.regionprops(label)
+            # sort componets based on their area
+            properties.sort(key=lambda x: x.area, reverse=True)
+            if len(properties) > 1 and \
+                    properties[0].area / properties[1].area < max_ratio:
+                return (label == properties[0].label,
+                        label == properties[1].label)
+            return None
+
+        # try the erosions in order and keep the first that separates the
+        # lungs; separation is not monotonic in k (a deeper erosion can shrink
+        # the smaller lung below max_ratio and then split the larger one), so
+        # the order matters
+        for k in range(max_iter):
+            eroded = separated(k)
+            if eroded is not None:
+                found = True
+                break
 
     # because eroded lung will has smaller volums than the original lung,
     # we need to label those eroded voxel based on their distances to the
     # two eroded lungs.
     if found:
-        # distance1 has the same shape as the 3D CT image, each voxel contains
+        # binnary masks for the larger and the smaller eroded lung
+        eroded1, eroded2 = eroded
+
+        # distance1 has the same shape as the lung box, each voxel contains
         # the euclidient distance from the voxel to the closest voxel within
-        # eroded1, so voxel within eroded1 will has distance 0.
-        distance1 = scipy.ndimage.morphology.\
-            distance_transform_edt(~eroded1, sampling=spacing)
-        distance2 = scipy.ndimage.morphology.\
-            distance_transform_edt(~eroded2, sampling=spacing)
+        # eroded1, so voxel within eroded1 will has distance 0. Both eroded
+        # lungs lie inside the box, so the distances equal those computed on
+        # the whole volume.
+        distance1 = scipy.ndimage.distance_transform_edt(
+            ~eroded1, sampling=spacing).astype(np.float32)
+        distance2 = scipy.ndimage.distance_transform_edt(
+            ~eroded2, sampling=spacing).astype(np.float32)
 
         # Original mask & lung1 mask
-        binary_mask1 = binary_mask_full & (distance1 < distance2)
+        binary_mask1 = np.zeros(binary_mask.shape, dtype=bool)
+        binary_mask1[box] = crop & (distance1 < distance2)
         # Original mask & lung2 mask
-        binary_mask2 = binary_mask_full & (distance1 > distance2)
+        binary_mask2 = np.zeros(binary_mask.shape, dtype=bool)
+        binary_mask2[box] = crop & (distance1 > distance2)
+        del distance1, distance2
 
         # remove bronchi/trachea and other small components
         binary_mask1 = extract_main(binary_mask1)
         binary_mask2 = extract_main(binary_mask2)
     else:
         # did not seperate the two lungs, use the original lung as one of them
-        binary_mask1 = binary_mask_full
+        binary_mask1 = np.copy(binary_mask)
         binary_mask2 = np.zeros(binary_mask.shape).astype('bool')
 
     binary_mask1 = fill_2d_hole(binary_mask1)
@@ -370,15 +472,23 @@ def seperate_two_lung(binary_mask, spacing, max_iter=22, max_ratio=4.8):
     return binary_mask1, binary_mask2
 
 
-def extract_lung(image, spacing):
+def extract_lung(image, spacing, downsample=1, refine=False):
     """
     Preprocess pipeline for extracting the lung from the raw 3D CT image.
     image: 3D numpy array of raw HU values from CT series in [z, y, x] order.
     spacing: float * 3, raw CT spacing in [z, y, x] order.
+    downsample: int, if > 1, segment a copy of the image downsampled by this
+        factor in-plane (block mean, e.g. 2 or 4) and upsample the two masks
+        back to the image shape, see extract_lung_coarse.
+    refine: bool, with downsample > 1, re-threshold the voxels near the mask
+        boundaries at full resolution.
     return: two 3D binary numpy array with the same shape of the image,
         that only region of interest is True. Each binary mask is ROI of one
         side of the lung. Also return if lung is found or not.
     """
+    if downsample > 1:
+        return extract_lung_coarse(image, spacing, downsample, refine)
+
     # binary mask with the same shape of the image, that only region of
     # interest is True.
     binary_mask = binarize(image, spacing)
@@ -406,6 +516,75 @@ def extract_lung(image, spacing):
     return (binary_mask1, binary_mask2, has_lung)
 
 
+def downsample_inplane(image, factor):
+    """
+    Block mean of image over factor x factor pixels of every slice, in
+    float32. Blocks cut by the slice border are averaged over the pixels
+    they contain.
+    """
+    image = image.astype(np.float32)
+    for axis in (1, 2):
+        starts = np.arange(0, image.shape[axis], factor)
+        counts = np.diff(np.append(starts, image.shape[axis])).astype(np.float32)
+        shape = [1, 1, 1]
+        shape[axis] = len(starts)
+        image = np.add.reduceat(image, starts, axis=axis) / counts.reshape(shape)
+    return image
+
+
+def upsample_inplane(binary_mask, factor, shape):
+    """Nearest-neighbour inverse of downsample_inplane, cropped to shape"""
+    binary_mask = np.repeat(np.repeat(binary_mask, factor, axis=1), factor, axis=2)
+    return binary_mask[:, :shape[1], :shape[2]]
+
+
+def refine_boundary(image, binary_mask, radius, intensity_thred=-600, sigma=1.0):
+    """
+    Re-decide the voxels within radius pixels (in-plane) of the boundary of an
+    upsampled mask at full resolution: inside that band a voxel belongs to the
+    lung if its smoothed HU value is below intensity_thred, as in binarize.
+    Voxels farther inside the mask are kept, voxels farther outside stay out.
+    """
+    if not binary_mask.any():
+        return binary_mask
+    struct = np.zeros((3, 3, 3), dtype=bool)
+    struct[1] = scipy.ndimage.generate_binary_structure(2, 1)
+    outer = scipy.ndimage.binary_dilation(binary_mask, struct, iterations=radius)
+    inner = scipy.ndimage.binary_erosion(binary_mask, struct, iterations=radius)
+
+    smoothed = scipy.ndimage.gaussian_filter(image.astype(np.float32),
+                                             (0, sigma, sigma), truncate=2.0)
+    return inner | (outer & ~inner & (smoothed < intensity_thred))
+
+
+def extract_lung_coarse(image, spacing, factor=2, refine=False):
+    """
+    extract_lung on the image downsampled in-plane by factor, with the masks
+    upsampled back to the image shape. Every step of the segmentation then
+    works on factor ** 2 times fewer voxels; the masks are only used for
+    apply_mask and get_lung_box, where the coarse boundary is good enough.
+    image: 3D numpy array of raw HU values from CT series in [z, y, x] order.
+    spacing: float * 3, raw CT spacing in [z, y, x] order.
+    factor: int, in-plane downsampling factor, e.g. 2 or 4.
+    refine: bool, refine the boundary of each mask at full resolution, see
+        refine_boundary.
+    return: same as extract_lung.
+    """
+    spacing = np.asarray(spacing, dtype=float)
+    image_small = downsample_inplane(image, factor)
+    spacing_small = spacing * image.shape / image_small.shape
+
+    binary_mask1, binary_mask2, has_lung = extract_lung(image_small, spacing_small)
+
+    binary_mask1 = upsample_inplane(binary_mask1, factor, image.shape)
+    binary_mask2 = upsample_inplane(binary_mask2, factor, image.shape)
+    if refine:
+        binary_mask1 = refine_boundary(image, binary_mask1, factor)
+        binary_mask2 = refine_boundary(image, binary_mask2, factor) & ~binary_mask1
+
+    return binary_mask1, binary_mask2, has_lung
+
+
 def HU2uint8(image, HU_min=-1200.0, HU_max=600.0, HU_nan=-2000.0):
     """
     Convert HU unit into uint8 values. First bound HU values by predfined min
@@ -426,38 +605,61 @@ def HU2uint8(image, HU_min=-1200.0, HU_max=600.0, HU_nan=-2000.0):
     return image_new
 
 
-def convex_hull_dilate(binary_mask, dilate_factor=1.5, iterations=10):
+# dilation radius of the lung hulls and the uint8 value of the regions that
+# apply_mask pads
+HULL_DILATE_ITERATIONS = 10
+PAD_VALUE = 170
+
+
+def convex_hull_dilate(binary_mask, dilate_factor=1.5,
+                       iterations=HULL_DILATE_ITERATIONS, num_threads=None):
     """
     Replace each slice with convex hull of it then dilate. Convex hulls used
     only if it does not increase area by dilate_factor. This applies mainly to
     the inferior slices because inferior surface of lungs is concave.
+    Everything is computed inside the bounding box of the mask extended by
+    the dilation radius.
     binary_mask: 3D binary numpy array with the same shape of the image,
         that only region of interest is True. One side of the lung in this
         specifical case.
     dilate_factor: float, factor of increased area after dilation
     iterations: int, number of iterations for dilation
+    num_threads: int, number of threads for the convex hulls, see map_slices.
     return: 3D binary numpy array with the same shape of the image,
         that only region of interest is True. Each binary mask is ROI of one
         side of the lung.
     """
-    binary_mask_dilated = np.array(binary_mask)
-    for i in range(binary_mask.shape[0]):
-        slice_binary = binary_mask[i]
+    binary_mask_dilated = np.zeros(binary_mask.shape, dtype=bool)
+    box = scipy.ndimage.find_objects(binary_mask.astype(np.uint8))
+    if not box:
+        return binary_mask_dilated
+
+    # lung box extended by the dilation radius
+    box = tuple(slice(max(0, s.start - iterations), min(n, s.stop + iterations))
+                for s, n in zip(box[0], binary_mask.shape))
+    crop = binary_mask[box]
+    crop_dilated = np.array(crop)
+
+    def process_slice(i):
+        slice_binary = crop[i]
+        slice_convex = morphology.convex_hull_image(slice_binary)
 
-        if np.sum(slice_binary) > 0:
-            slice_convex = morphology.convex_hull_image(slice_binary)
+        if np.sum(slice_convex) <= dilate_factor * np.sum(slice_binary):
+            crop_dilated[i] = slice_convex
 
-            if np.sum(slice_convex) <= dilate_factor * np.sum(slice_binary):
-                binary_mask_dilated[i] = slice_convex
+    # empty slices are skipped, as np.sum(slice_binary) > 0 did before
+    map_slices(process_slice, crop, num_threads)
 
-    struct = scipy.ndimage.morphology.generate_binary_structure(3, 1)
-    binary_mask_dilated = scipy.ndimage.morphology.binary_dilation(
-        binary_mask_dilated, structure=struct, iterations=10)
+    # dilating `iterations` times with the 6-connected structure reaches
+    # exactly the voxels within taxicab distance `iterations` of the mask
+    distance = scipy.ndimage.distance_transform_cdt(~crop_dilated,
+                                                    metric='taxicab')
+    binary_mask_dilated[box] = distance <= iterations
 
     return binary_mask_dilated
 
 
-def apply_mask(image, binary_mask1, binary_mask2, pad_value=170,
+def apply_mask(image, binary_mask1, binary_mask2, pad_value=PAD_VALUE,
                bone_thred=210, remove_bone=False):
     """
     Apply the binary mask of each lung to the image. Regions out of interest
@@ -475,8 +677,12 @@ def apply_mask(image, binary_mask1, binary_mask2, pad_value=170,
         applying the lung mask.
     """
     binary_mask = binary_mask1 + binary_mask2
-    binary_mask1_dilated = convex_hull_dilate(binary_mask1)
-    binary_mask2_dilated = convex_hull_dilate(binary_mask2)
+    # the two lungs are independent, dilate them concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        dilated1 = executor.submit(convex_hull_dilate, binary_mask1)
+        dilated2 = executor.submit(convex_hull_dilate, binary_mask2)
+        binary_mask1_dilated = dilated1.result()
+        binary_mask2_dilated = dilated2.result()
     binary_mask_dilated = binary_mask1_dilated + binary_mask2_dilated
     binary_mask_extra = binary_mask_dilated ^ binary_mask
 
@@ -492,7 +698,197 @@ def apply_mask(image, binary_mask1, binary_mask2, pad_value=170,
     return image_new
 
 
-def resample(image, spacing, new_spacing=[1.0, 1.0, 1.0], order=1):
+# scipy pads this many voxels with edge values before the spline prefilter
+# when mode='nearest'; the separable engine uses the same margin, both at the
+# volume border and as overlap between neighbouring z chunks.
+SPLINE_MARGIN = 12
+
+
+def zoom_coordinates(in_len, out_len):
+    """
+    Input coordinate of every output voxel along one axis, using the same
+    mapping as scipy.ndimage.zoom (grid_mode=False): the first and last voxels
+    of input and output are aligned.
+    """
+    if out_len <= 1:
+        return np.zeros(out_len)
+    return np.arange(out_len) * ((in_len - 1) / (out_len - 1))
+
+
+def spline_taps(coords, order):
+    """
+    Indices and weights of the B-spline kernel of the given order evaluated
+    at coords.
+    return: (indices, weights), both of shape [taps, len(coords)]. Indices may
+        fall outside the input axis and are clamped by the caller.
+    """
+    if order == 0:
+        indices = np.floor(coords + 0.5).astype(np.int64)[None]
+        weights = np.ones(indices.shape, dtype=np.float32)
+        return indices, weights
+
+    start = np.floor(coords).astype(np.int64)
+    t = coords - start
+    if order == 1:
+        indices = np.stack([start, start + 1])
+        weights = np.stack([1 - t, t])
+    elif order == 3:
+        indices = np.stack([start - 1, start, start + 1, start + 2])
+        weights = np.stack([(1 - t) ** 3 / 6,
+                            (3 * t ** 3 - 6 * t ** 2 + 4) / 6,
+                            (-3 * t ** 3 + 3 * t ** 2 + 3 * t + 1) / 6,
+                            t ** 3 / 6])
+    else:
+        raise ValueError('order %s is not supported by the separable engine' % order)
+
+    return indices, weights.astype(np.float32)
+
+
+def cast_like(values, dtype):
+    """
+    Convert float interpolation results to dtype the way scipy.ndimage does:
+    integers are rounded and clipped to the range of the type.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'iu':
+        info = np.iinfo(dtype)
+        values = np.clip(np.rint(values), info.min, info.max)
+    return values.astype(dtype)
+
+
+def interpolate_axis(image, coords, axis, order, executor, out_dtype=np.float32,
+                     chunk_size=16):
+    """
+    1D spline interpolation of image along one axis at coords, in float32.
+    Axes 1 and 2 are chunked along z without overlap; axis 0 is chunked along
+    the output z, and each chunk reads SPLINE_MARGIN extra input slices on
+    both sides so the spline prefilter sees the same neighbourhood as on the
+    full volume. Chunks are processed on executor.
+    """
+    length = image.shape[axis]
+    indices, weights = spline_taps(coords, order)
+    margin = SPLINE_MARGIN if order > 1 else 0
+
+    out_shape = list(image.shape)
+    out_shape[axis] = len(coords)
+    out = np.empty(out_shape, dtype=out_dtype)
+
+    def run(src, out_slice, taps, tap_weights):
+        # input rows needed by these outputs, clamped = edge padding ('nearest')
+        low = taps.min() - margin
+        rows = np.clip(np.arange(low, taps.max() + 1 + margin), 0, length - 1)
+        block = np.take(src, rows, axis=axis).astype(np.float32, copy=False)
+        if order > 1:
+            block = scipy.ndimage.spline_filter1d(block, order, axis=axis,
+                                                  mode='mirror',
+                                                  output=np.float32)
+
+        weight_shape = [1] * block.ndim
+        weight_shape[axis] = taps.shape[1]
+        result = None
+        for k in range(taps.shape[0]):
+            term = np.take(block, taps[k] - low, axis=axis)
+            term *= tap_weights[k].reshape(weight_shape)
+            if result is None:
+                result = term
+            else:
+                result += term
+        out[out_slice] = cast_like(result, out_dtype)
+
+    futures = []
+    if axis == 0:
+        for start in range(0, len(coords), chunk_size):
+            stop = min(start + chunk_size, len(coords))
+            futures.append(executor.submit(run, image, slice(start, stop),
+                                           indices[:, start:stop],
+                                           weights[:, start:stop]))
+    else:
+        for start in range(0, image.shape[0], chunk_size):
+            stop = min(start + chunk_size, image.shape[0])
+            futures.append(executor.submit(run, image[start:stop],
+                                           slice(start, stop),
+                                           indices, weights))
+    for future in futures:
+        future.result()
+
+    return out
+
+
+def zoom_separable(image, new_shape, order=3, num_threads=None, out_box=None):
+    """
+    Drop-in replacement of scipy.ndimage.zoom(image, new_shape / image.shape,
+    mode='nearest', order=order) for 3D volumes. Interpolates one axis at a
+    time in float32 (the axis that shrinks the most first) and spreads the
+    chunks of every pass over num_threads threads. Orders other than 0, 1 and
+    3 fall back to scipy.ndimage.zoom.
+    image: 3D numpy array in [z, y, x] order.
+    new_shape: int * 3, shape of the output.
+    num_threads: int, number of worker threads, None for os.cpu_count().
+    out_box: optional 3x2 int array [[z_min, z_max], [y_min, y_max],
+        [x_min, x_max]] in the coordinates of the resampled image. Only this
+        box of the output is computed, and only the block of the input it
+        depends on (plus the spline margin) is read, so the result equals
+        zooming the whole volume and then cropping.
+    return: resampled image (or the out_box of it) with the dtype of the input.
+    """
+    new_shape = tuple(int(n) for n in new_shape)
+    if out_box is None:
+        out_box = [[0, n] for n in new_shape]
+    out_box = [(int(low), int(high)) for low, high in out_box]
+
+    if order not in (0, 1, 3) or image.ndim != 3:
+        resize_factor = np.array(new_shape) / np.array(image.shape)
+        image_new = scipy.ndimage.zoom(image, resize_factor, mode='nearest',
+                                       order=order)
+        return image_new[tuple(slice(low, high) for low, high in out_box)]
+
+    # per axis: coordinates of the wanted outputs and the input range they need
+    crop, axis_coords = [], {}
+    for axis in range(3):
+        low, high = out_box[axis]
+        if new_shape[axis] == image.shape[axis]:
+            crop.append(slice(low, high))
+            continue
+        coords = zoom_coordinates(image.shape[axis], new_shape[axis])[low:high]
+        indices, _ = spline_taps(coords, order)
+        margin = SPLINE_MARGIN if order > 1 else 0
+        in_low = max(0, int(indices.min()) - margin)
+        in_high = min(image.shape[axis], int(indices.max()) + 1 + margin)
+        crop.append(slice(in_low, in_high))
+        axis_coords[axis] = coords - in_low
+    block = image[tuple(crop)]
+
+    axes = sorted(axis_coords,
+                  key=lambda a: len(axis_coords[a]) / block.shape[a])
+    if not axes:
+        return block.copy()
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        result = block
+        for i, axis in enumerate(axes):
+            out_dtype = image.dtype if i == len(axes) - 1 else np.float32
+            result = interpolate_axis(result, axis_coords[axis], axis, order,
+                                      executor, out_dtype=out_dtype)
+
+    return result
+
+
+def resample_shape(shape, spacing, new_spacing=[1.0, 1.0, 1.0]):
+    """
+    Shape of the image after resampling from spacing to new_spacing and the
+    actual spacing of the resampled image.
+    """
+    # shape can only be int, so has to be rounded.
+    new_shape = np.round(shape * spacing / new_spacing)
+
+    # the actual spacing to resample.
+    resample_spacing = spacing * shape / new_shape
+
+    return new_shape, resample_spacing
+
+
+def resample(image, spacing, new_spacing=[1.0, 1.0, 1.0], order=1,
+             num_threads=None):
     """
     Resample image from the original spacing to new_spacing, e.g. 1x1x1
     image: 3D numpy array of raw HU values from CT series in [z, y, x] order.
@@ -500,45 +896,135 @@ def resample(image, spacing, new_spacing=[1.0, 1.0, 1.0], order=1):
     new_spacing: float * 3, new spacing used for resample, typically 1x1x1,
         which means standardizing the raw CT with different spacing all into
         1x1x1 mm.
-    order: int, order for resample function scipy.ndimage.interpolation.zoom
+    order: int, spline order of the interpolation, same meaning as in
+        scipy.ndimage.interpolation.zoom
+    num_threads: int, number of threads used by zoom_separable, None for
+        os.cpu_count().
     return: 3D binary numpy array with the same shape of the image after,
         resampling. The actual resampling spacing is also returned.
     """
-    # shape can only be int, so has to be rounded.
-    new_shape = np.round(image.shape * spacing / new_spacing)
-
-    # the actual spacing to resample.
-    resample_spacing = spacing * image.shape / new_shape
-
-    resize_factor = new_shape / image.shape
+    new_shape, resample_spacing = resample_shape(image.shape, spacing,
+                                                 new_spacing)
 
-    image_new = scipy.ndimage.interpolation.zoom(image, resize_factor,
-                                                 mode='nearest', order=order)
+    image_new = zoom_separable(image, new_shape, order=order,
+                               num_threads=num_threads)
 
     return (image_new, resample_spacing)
 
 
-def get_lung_box(binary_mask, new_shape, margin=5):
+def resample_labels(label_map, spacing, new_spacing=[1.0, 1.0, 1.0], order=3,
+                    num_threads=None):
     """
-    Get the lung barely surrounding the lung based on the binary_mask and the
-    new_spacing.
-    binary_mask: 3D binary numpy array with the same shape of the image,
-        that only region of both sides of the lung is True.
-    new_shape: tuple of int * 3, new shape of the image after resamping in
-        [z, y, x] order.
-    margin: int, number of voxels to extend the boundry of the lung box.
-    return: 3x2 2D int numpy array denoting the
-        [z_min:z_max, y_min:y_max, x_min:x_max] of the lung box with respect to
-        the image after resampling.
+    Resample an instance label map (0 = background, 1..n = instances) in one
+    call. For order 1 or 3 every instance is interpolated as a binary mask and
+    thresholded at 0.5, like resampling each (label_map == i) separately, but
+    only inside the bounding box of that instance (plus the spline margin)
+    instead of over the whole volume. Later labels overwrite earlier ones
+    where they overlap. order=0 is plain nearest-neighbour on the label map.
+    label_map: 3D integer numpy array in [z, y, x] order.
+    spacing: float * 3, raw CT spacing in [z, y, x] order.
+    return: resampled label map with the dtype of label_map, and the actual
+        resampling spacing.
     """
-    # list of z, y x indexes that are true in binary_mask
-    z_true, y_true, x_true = np.where(binary_mask)
-    old_shape = binary_mask.shape
+    new_shape, resample_spacing = resample_shape(label_map.shape, spacing,
+                                                 new_spacing)
+    new_shape = new_shape.astype(int)
+    if order == 0:
+        return (zoom_separable(label_map, new_shape, order=0,
+                               num_threads=num_threads), resample_spacing)
+
+    label_new = np.zeros(new_shape, dtype=label_map.dtype)
+    # 2 extra input voxels for the kernel taps of outputs next to the box
+    margin = SPLINE_MARGIN + 2
+    objects = scipy.ndimage.find_objects(label_map.astype(np.int64, copy=False))
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        for value, box in enumerate(objects, 1):
+            if box is None:
+                continue
+
+            in_crop, out_crop, axis_coords = [], [], []
+            for axis, box_slice in enumerate(box):
+                coords = zoom_coordinates(label_map.shape[axis], new_shape[axis])
+                # interpolated mask can only reach 0.5 within one voxel of the box
+                out_low = np.searchsorted(coords, box_slice.start - 1)
+                out_high = np.searchsorted(coords, box_slice.stop, side='right')
+                in_low = max(0, box_slice.start - margin)
+                in_high = min(label_map.shape[axis], box_slice.stop + margin)
+                in_crop.append(slice(in_low, in_high))
+                out_crop.append(slice(out_low, out_high))
+                axis_coords.append(coords[out_low:out_high] - in_low)
+
+            result = (label_map[tuple(in_crop)] == value).astype(np.float32)
+            for axis in sorted(range(3), key=lambda a: len(axis_coords[a]) /
+                               result.shape[a]):
+                result = interpolate_axis(result, axis_coords[axis], axis,
+                                          order, executor)
+            label_new[tuple(out_crop)][result >= 0.5] = value
+
+    return label_new, resample_spacing
+
+
+def block_mean_pyramid(image, factors=(2, 4)):
+    """
+    Downsampled levels of image by block mean, e.g. 2 mm and 4 mm levels of a
+    1 mm volume. Block sums are computed once at the finest factor and reused
+    for the coarser ones, so all levels come from a single pass over image.
+    Blocks at the far border that are cut by the image edge are averaged over
+    the voxels they actually contain.
+    image: 3D numpy array in [z, y, x] order.
+    factors: increasing ints, each a multiple of the previous one.
+    return: list of arrays with the dtype of image, one per factor. Voxel i of
+        the level with factor f covers voxels [i * f, (i + 1) * f) of image.
+    """
+    levels = []
+    sums = image.astype(np.float32)
+    counts = [np.ones(n, dtype=np.float32) for n in image.shape]
+    previous = 1
+    for factor in factors:
+        if factor % previous:
+            raise ValueError('pyramid factors must be multiples of each other')
+        step = factor // previous
+        for axis in range(3):
+            starts = np.arange(0, sums.shape[axis], step)
+            sums = np.add.reduceat(sums, starts, axis=axis)
+            counts[axis] = np.add.reduceat(counts[axis], starts)
+        previous = factor
+
+        voxels = counts[0][:, None, None] * counts[1][None, :, None] * \
+            counts[2][None, None, :]
+        levels.append(cast_like(sums / voxels, image.dtype))
+
+    return levels
+
+
+def mask_bounds(binary_mask):
+    """
+    Bounds of the True voxels of binary_mask, from its projections on the
+    axes instead of the indexes of every voxel.
+    binary_mask: 3D binary numpy array.
+    return: 3x2 2D int numpy array denoting the [min, max] (both inclusive)
+        index of the True voxels along z, y and x.
+    """
+    zy = np.any(binary_mask, axis=2)
+    z_any = np.flatnonzero(zy.any(axis=1))
+    if not len(z_any):
+        raise ValueError('binary_mask is empty')
+    y_any = np.flatnonzero(zy.any(axis=0))
+    # x only needs the slices between z_min and z_max
+    x_any = np.flatnonzero(np.any(binary_mask[z_any[0]:z_any[-1] + 1], axis=(0, 1)))
+
+    return np.array([[z_any[0], z_any[-1]],
+                     [y_any[0], y_any[-1]],
+                     [x_any[0], x_any[-1]]])
+
 
-    lung_box = np.array([[np.min(z_true), np.max(z_true)],
-                        [np.min(y_true), np.max(y_true)],
-                        [np.min(x_true), np.max(x_true)]])
-    lung_box = lung_box * 1.0 * \
+def lung_box_from_bounds(bounds, old_shape, new_shape, margin=5):
+    """
+    Lung box of get_lung_box, from the bounds of the mask (see mask_bounds)
+    and the shape of the image they refer to.
+    """
+    lung_box = bounds * 1.0 * \
         np.expand_dims(new_shape, 1) / np.expand_dims(old_shape, 1)
     lung_box = np.floor(lung_box).astype('int')
 
@@ -554,55 +1040,67 @@ def get_lung_box(binary_mask, new_shape, margin=5):
     return lung_box
 
 
+def get_lung_box(binary_mask, new_shape, margin=5):
+    """
+    Get the lung barely surrounding the lung based on the binary_mask and the
+    new_spacing.
+    binary_mask: 3D binary numpy array with the same shape of the image,
+        that only region of both sides of the lung is True.
+    new_shape: tuple of int * 3, new shape of the image after resamping in
+        [z, y, x] order.
+    margin: int, number of voxels to extend the boundry of the lung box.
+    return: 3x2 2D int numpy array denoting the
+        [z_min:z_max, y_min:y_max, x_min:x_max] of the lung box with respect to
+        the image after resampling.
+    """
+    return lung_box_from_bounds(mask_bounds(binary_mask), binary_mask.shape,
+                                new_shape, margin)
+
+
+def set_num_threads(num_threads):
+    """
+    Set the global default number of threads of SimpleITK filters.
+    num_threads: int, None leaves SimpleITK's own default untouched
+    """
+    if num_threads is not None:
+        sitk.ProcessObject_SetGlobalDefaultNumberOfThreads(int(num_threads))
+
+
 def auxiliary_segment(image):
     """
     In case of failure of the first segmentation method, use sitk lib for further segmentation
     image: numpy array of raw CT image, [D, H, W] in z, y, x order
     return: numpy array of lung mask
     """
-    def fill_hole_2d(image):
+    def fill_hole_2d(mask):
         """
-        Fill hole slice by slice from axial view
-        image: numpy array of raw CT image, [D, H, W]
+        Fill hole slice by slice from axial view, in a single call over the whole volume:
+        the structure only connects pixels within a slice, so holes are found per slice
+        (same 4-connected background as sitk.BinaryFillhole on a 2D slice)
+        mask: sitk binary image, [D, H, W] as array
         """
-        image = image.copy()
-        D, H, W = image.shape
-        sitk_img = sitk.GetImageFromArray(image)
-        
-        for i in range(D):
-            image[i] = sitk.GetArrayFromImage(sitk.BinaryFillhole(sitk_img[:, :, i]))
-            
-        return sitk.GetImageFromArray(image)
-
-    def morphology_closing_2d(image):
-        """
-        Morphology closing slice by slice from axial view
-        image: numpy array of raw CT image, [D, H, W]
-        """
-        image = image.copy()
-        D, H, W = image.shape
-        sitk_img = sitk.GetImageFromArray(image)
-        
-        for i in range(D):
-            image[i] = sitk.GetArrayFromImage(sitk.BinaryMorphologicalOpening(sitk_img[:, :, i], 5))
-            
-        return sitk.GetImageFromArray(image)
+        structure = np.zeros((3, 3, 3), dtype=bool)
+        structure[1] = scipy.ndimage.generate_binary_structure(2, 1)
+        filled = scipy.ndimage.binary_fill_holes(sitk.GetArrayViewFromImage(mask), structure=structure)
+        filled = sitk.GetImageFromArray(filled.astype(np.uint8))
+        filled.CopyInformation(mask)
+        return filled
 
     mask = 1 - sitk.OtsuThreshold(sitk.GetImageFromArray(image))
-    mask = morphology_closing_2d(sitk.GetArrayFromImage(mask))
+    # Morphology opening slice by slice from axial view, radius is given in x, y, z order
+    mask = sitk.BinaryMorphologicalOpening(mask, [5, 5, 0])
 
-    mask_npy = sitk.GetArrayFromImage(mask)
-    chest_mask = fill_hole_2d(mask_npy)
-    lung_mask = sitk.Subtract(sitk.GetImageFromArray(sitk.GetArrayFromImage(chest_mask)), mask)
+    chest_mask = fill_hole_2d(mask)
+    lung_mask = sitk.Subtract(chest_mask, mask)
         
     # Remove areas not in the chest, when CT covers regions below the chest
-    eroded_mask = sitk.BinaryErode(lung_mask, 15)
+    eroded_mask = sitk.BinaryErode(lung_mask, [15, 15, 15])
     seed_npy = sitk.GetArrayFromImage(eroded_mask)
     seed_npy = np.array(seed_npy.nonzero())[[2,1,0]]
     seeds = seed_npy.T.tolist()
     connected_lung = sitk.ConfidenceConnected(lung_mask, seeds, multiplier=2.5)
-    final_mask = sitk.BinaryMorphologicalClosing(connected_lung, 5)
-    final_mask = sitk.BinaryDilate(final_mask, 5)
+    final_mask = sitk.BinaryMorphologicalClosing(connected_lung, [5, 5, 5])
+    final_mask = sitk.BinaryDilate(final_mask, [5, 5, 5])
     
     return sitk.GetArrayFromImage(final_mask)
 
@@ -625,11 +1123,8 @@ def preprocess(params):
     if do_resample:
         print('Resampling...')
         seg_img, resampled_spacing = resample(seg_img, spacing, order=3)
-        seg_nod_mask = np.zeros(seg_img.shape, dtype=np.uint8)
-        for i in range(int(nod_mask.max())):
-            mask = (nod_mask == (i + 1)).astype(np.uint8)
-            mask, _ = resample(mask, spacing, order=3)
-            seg_nod_mask[mask > 0.5] = i + 1
+        seg_nod_mask, _ = resample_labels(nod_mask.astype(np.uint8), spacing,
+                                          order=3)
 
     lung_box = get_lung_box(binary_mask, seg_img.shape)
 
@@ -641,6 +1136,7 @@ def preprocess(params):
     seg_nod_mask = seg_nod_mask[z_min:z_max, y_min:y_max, x_min:x_max]
     np.save(os.path.join(save_dir, '%s_origin.npy' % (pid)), origin)
     np.save(os.path.join(save_dir, '%s_spacing.npy' % (pid)), resampled_spacing)
+    np.save(os.path.join(save_dir, '%s_original_spacing.npy' % (pid)), spacing)
     np.save(os.path.join(save_dir, '%s_ebox_origin.npy' % (pid)), np.array((z_min, y_min, x_min)))
     nrrd.write(os.path.join(save_dir, '%s_clean.nrrd' % (pid)), seg_img)
     nrrd.write(os.path.join(save_dir, '%s_mask.nrrd' % (pid)), seg_nod_mask)
@@ -701,45 +1197,74 @@ def main():
 
 
 
-def preprocess_for_inference(img_path, lung_mask_path, save_dir, do_resample=True):
+def segment_lung(image, spacing, downsample=1, refine=False):
     """
-    img_path、lung_mask_path 分别是对应的.mhd文件路径
+    In-memory lung segmentation for inference: extract_lung first, and
+    auxiliary_segment when it does not find the lungs.
+    image: 3D numpy array of raw HU values from CT series in [z, y, x] order.
+    spacing: float * 3, raw CT spacing in [z, y, x] order.
+    downsample, refine: coarse segmentation mode, see extract_lung.
+    return: two 3D binary numpy arrays, one per side of the lung (the second
+        one is empty when auxiliary_segment is used, as it does not separate
+        the lungs).
     """
-    print(f'[INFO] Preprocessing {img_path} (inference)...')
-
-    img_path = img_path
-    mask_path = lung_mask_path
+    binary_mask1, binary_mask2, has_lung = extract_lung(image, spacing, downsample, refine)
+    if has_lung and (binary_mask1.any() or binary_mask2.any()):
+        return binary_mask1, binary_mask2
+
+    print('[INFO] extract_lung did not find the lungs, using auxiliary_segment...')
+    binary_mask1 = auxiliary_segment(image) > 0
+    binary_mask2 = np.zeros(image.shape, dtype=bool)
+    if not binary_mask1.any():
+        raise ValueError('no lung found in the image')
+    return binary_mask1, binary_mask2
 
-    # 1. Load image and lung mask
-    img, origin, spacing = load_itk_image(img_path)
-    lung_mask, _, _ = load_itk_image(mask_path)
 
-    # 2. Build binary lung masks (label 3 and 4)
-    binary_mask1 = (lung_mask == 4)
-    binary_mask2 = (lung_mask == 3)
+def preprocess_arrays_for_inference(img, origin, spacing, binary_mask1, binary_mask2, save_dir,
+                                    do_resample=True, crop_before_resample=True, pyramid_factors=(2, 4)):
+    """
+    preprocess_for_inference 的核心部分，输入均为内存中的数组：
+    img 为原始 HU 图像，origin、spacing 为 [z, y, x] 顺序，binary_mask1、binary_mask2 为左右肺的二值掩码。
+    结果保存到 save_dir，参数含义见 preprocess_for_inference。
+    """
     binary_mask = binary_mask1 + binary_mask2
+    bounds = mask_bounds(binary_mask)
+
+    # apply_mask pads everything farther than the hull dilation radius from
+    # the lungs, so steps 3-4 only need the lung bounds extended by it
+    crop = tuple(slice(max(0, low - HULL_DILATE_ITERATIONS), min(n, high + 1 + HULL_DILATE_ITERATIONS))
+                 for (low, high), n in zip(bounds, img.shape))
 
     # 3. Convert to uint8 HU windowed image
-    img = HU2uint8(img)
+    img_crop = HU2uint8(img[crop])
 
     # 4. Apply lung mask (with convex hull, pad background)
-    seg_img = apply_mask(img, binary_mask1, binary_mask2)
-
-    # 5. Optional resample to 1x1x1
-    if do_resample:
-        print('[INFO] Resampling image to 1x1x1 mm spacing...')
-        seg_img, resampled_spacing = resample(seg_img, spacing, order=3)
+    seg_img = np.full(img.shape, PAD_VALUE, dtype=np.uint8)
+    seg_img[crop] = apply_mask(img_crop, binary_mask1[crop], binary_mask2[crop], pad_value=PAD_VALUE)
+
+    if do_resample and crop_before_resample:
+        # 5-7. Lung box in resampled coordinates, then resample only that box
+        print('[INFO] Resampling lung box to 1x1x1 mm spacing...')
+        new_shape, resampled_spacing = resample_shape(seg_img.shape, spacing)
+        lung_box = lung_box_from_bounds(bounds, seg_img.shape, new_shape.astype(int))
+        seg_img = zoom_separable(seg_img, new_shape, order=3, out_box=lung_box)
+        z_min, y_min, x_min = lung_box[:, 0]
     else:
-        resampled_spacing = spacing
+        # 5. Optional resample to 1x1x1
+        if do_resample:
+            print('[INFO] Resampling image to 1x1x1 mm spacing...')
+            seg_img, resampled_spacing = resample(seg_img, spacing, order=3)
+        else:
+            resampled_spacing = spacing
 
-    # 6. Get lung bounding box for cropping
-    lung_box = get_lung_box(binary_mask, seg_img.shape)
-    z_min, z_max = lung_box[0]
-    y_min, y_max = lung_box[1]
-    x_min, x_max = lung_box[2]
+        # 6. Get lung bounding box for cropping
+        lung_box = lung_box_from_bounds(bounds, img.shape, seg_img.shape)
+        z_min, z_max = lung_box[0]
+        y_min, y_max = lung_box[1]
+        x_min, x_max = lung_box[2]
 
-    # 7. Crop image to lung box
-    seg_img = seg_img[z_min:z_max, y_min:y_max, x_min:x_max]
+        # 7. Crop image to lung box
+        seg_img = seg_img[z_min:z_max, y_min:y_max, x_min:x_max]
 
     # 8. Save results
     if not os.path.exists(save_dir):
@@ -747,11 +1272,59 @@ def preprocess_for_inference(img_path, lung_mask_path, save_dir, do_resample=Tru
 
     np.save(os.path.join(save_dir, f'processed_origin.npy'), origin)
     np.save(os.path.join(save_dir, f'processed_spacing.npy'), resampled_spacing)
+    np.save(os.path.join(save_dir, f'processed_original_spacing.npy'), spacing)
     np.save(os.path.join(save_dir, f'processed_ebox_origin.npy'), np.array([z_min, y_min, x_min]))
     nrrd.write(os.path.join(save_dir, f'processed_clean.nrrd'), seg_img)
+    for factor, level in zip(pyramid_factors, block_mean_pyramid(seg_img, pyramid_factors)):
+        # levels are only in mm when the volume was resampled to 1 mm
+        level_name = f'{factor}mm' if do_resample else f'x{factor}'
+        nrrd.write(os.path.join(save_dir, f'processed_clean_{level_name}.nrrd'), level)
 
     print(f'[✔] Preprocessing finished for picture. Output saved to {save_dir}\n')
 
 
+def preprocess_for_inference(img_path, lung_mask_path, save_dir, do_resample=True,
+                             crop_before_resample=True, pyramid_factors=(2, 4)):
+    """
+    img_path、lung_mask_path 分别是对应的.mhd文件路径
+    crop_before_resample: 为 True 时先在原始体素空间算出肺部包围盒，只对包围盒（加上插值需要的边缘）重采样，
+        输出与先整体重采样再裁剪相同，但省去了包围盒外的插值计算和内存
+    pyramid_factors: 额外保存的降采样层级，按块平均得到，如 2、4 对应 processed_clean_2mm.nrrd、
+        processed_clean_4mm.nrrd（1mm 体数据的 2 倍、4 倍降采样），供 GUI 预览和由粗到细的候选搜索使用；
+        do_resample 为 False 时体数据保持原始 spacing，文件按倍数命名为 processed_clean_x2.nrrd、processed_clean_x4.nrrd
+    """
+    print(f'[INFO] Preprocessing {img_path} (inference)...')
+
+    # 1. Load image and lung mask
+    img, origin, spacing = load_itk_image(img_path)
+    lung_mask, _, _ = load_itk_image(lung_mask_path)
+
+    # 2. Build binary lung masks (label 3 and 4)
+    binary_mask1 = (lung_mask == 4)
+    binary_mask2 = (lung_mask == 3)
+
+    preprocess_arrays_for_inference(img, origin, spacing, binary_mask1, binary_mask2, save_dir,
+                                    do_resample, crop_before_resample, pyramid_factors)
+
+
+def preprocess_image_for_inference(img_path, save_dir, do_resample=True,
+                                   crop_before_resample=True, pyramid_factors=(2, 4),
+                                   seg_downsample=1, seg_refine=False):
+    """
+    与 preprocess_for_inference 相同，但不需要事先准备的肺部掩码文件：
+    肺部掩码由 segment_lung 在内存中得到（extract_lung，失败时用 auxiliary_segment）。
+    img_path 为 .mhd 文件路径
+    seg_downsample、seg_refine: 大于 1 时在层内降采样 seg_downsample 倍的图像上分割肺部再上采样掩码，
+        seg_refine 为 True 时在原分辨率下修正掩码边界，见 extract_lung
+    """
+    print(f'[INFO] Preprocessing {img_path} (inference, lung segmentation)...')
+
+    img, origin, spacing = load_itk_image(img_path)
+    binary_mask1, binary_mask2 = segment_lung(img, spacing, seg_downsample, seg_refine)
+
+    preprocess_arrays_for_inference(img, origin, spacing, binary_mask1, binary_mask2, save_dir,
+                                    do_resample, crop_before_resample, pyramid_factors)
+
+
 if __name__=='__main__':
     main()
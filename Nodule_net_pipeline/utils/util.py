@@ -18,6 +18,7 @@ import SimpleITK as sitk
 import pydicom
 import matplotlib.cm as cm
 import math
+from functools import lru_cache
 from skimage import measure
 from scipy.ndimage import zoom
 from scipy.sparse import csr_matrix
@@ -60,6 +61,72 @@ def voxelToWorldCoord(voxelCoord, origin, spacing):
     return worldCoord
 
 
+class CoordinateTransform(object):
+    """
+    Coordinate transforms of one preprocessed study, all in [z, y, x] order:
+    preprocessed voxel (inside the cropped lung box of *_clean.nrrd), original
+    voxel (the raw .mhd image) and world mm. *_origin.npy, *_spacing.npy,
+    *_ebox_origin.npy and *_original_spacing.npy are loaded once; every method
+    takes a (3,) or (N, 3) array and converts all rows at once.
+    Use load_transform() to share one instance per study.
+    """
+    def __init__(self, prep_dir, name):
+        """
+        :param prep_dir: directory saving preprocessing results
+        :param name: file prefix, patient id for training, 'processed' for inference
+        """
+        self.prep_dir = prep_dir
+        self.name = name
+        self.origin = self._load('origin')
+        self.spacing = self._load('spacing')
+        self.ebox_origin = self._load('ebox_origin')
+        self._original_spacing = None
+
+    def _load(self, key):
+        return np.load(os.path.join(self.prep_dir, '%s_%s.npy' % (self.name, key))).astype(np.float64)
+
+    @property
+    def original_spacing(self):
+        # only written by newer preprocessing, so loaded on first use
+        if self._original_spacing is None:
+            self._original_spacing = self._load('original_spacing')
+        return self._original_spacing
+
+    def preprocessed_to_world(self, coords):
+        return (np.asarray(coords, dtype=np.float64) + self.ebox_origin) * self.spacing + self.origin
+
+    def world_to_preprocessed(self, world):
+        return (np.asarray(world, dtype=np.float64) - self.origin) / self.spacing - self.ebox_origin
+
+    def original_to_world(self, coords):
+        return np.asarray(coords, dtype=np.float64) * self.original_spacing + self.origin
+
+    def world_to_original(self, world):
+        return (np.asarray(world, dtype=np.float64) - self.origin) / self.original_spacing
+
+    def preprocessed_to_original(self, coords):
+        return self.world_to_original(self.preprocessed_to_world(coords))
+
+    def original_to_preprocessed(self, coords):
+        return self.world_to_preprocessed(self.original_to_world(coords))
+
+
+@lru_cache(maxsize=1024)
+def _cached_transform(prep_dir, name, stamp):
+    return CoordinateTransform(prep_dir, name)
+
+
+def load_transform(prep_dir, name):
+    """
+    CoordinateTransform of a study, each study is loaded from disk only once.
+    The files' mtimes are part of the cache key, so re-preprocessing a study
+    (e.g. inference results always saved as 'processed_*') is picked up.
+    """
+    stamp = tuple(os.stat(os.path.join(prep_dir, '%s_%s.npy' % (name, key))).st_mtime_ns
+                  for key in ('origin', 'spacing', 'ebox_origin'))
+    return _cached_transform(prep_dir, name, stamp)
+
+
 def npy2submission(set_name, save_path, bbox_dir, prep_dir, postfix='detection'):
     """
     :param set_name: lists of patient names
@@ -84,18 +151,15 @@ def npy2submission(set_name, save_path, bbox_dir, prep_dir, postfix='detection')
         if len(pbb) == 0:
             continue
         pbb = pbb[pbb[:, 0].argsort()][::-1][:k]
-        spacing = np.load(os.path.join(prep_dir, name + '_spacing.npy'))
-        ebox_origin = np.load(os.path.join(prep_dir, name + '_ebox_origin.npy'))
-        origin = np.load(os.path.join(prep_dir, name + '_origin.npy'))
-
-        for p in pbb:
-            ebox_coord = p[[1, 2, 3]]
-            whole_img_coord = ebox_coord + ebox_origin
-            worldCoord = voxelToWorldCoord(whole_img_coord, origin, spacing)
-            submission.append([name, worldCoord[2], worldCoord[1], worldCoord[0], p[0]])
-
-    submission = pd.DataFrame(submission, columns=["seriesuid", "coordX", "coordY", "coordZ",
-                                                   "probability"])
+        worldCoord = load_transform(prep_dir, name).preprocessed_to_world(pbb[:, [1, 2, 3]])
+        submission.append(pd.DataFrame({"seriesuid": name,
+                                        "coordX": worldCoord[:, 2],
+                                        "coordY": worldCoord[:, 1],
+                                        "coordZ": worldCoord[:, 0],
+                                        "probability": pbb[:, 0]}))
+
+    columns = ["seriesuid", "coordX", "coordY", "coordZ", "probability"]
+    submission = pd.concat(submission, ignore_index=True) if submission else pd.DataFrame(columns=columns)
 
     print("Saving submission to", save_path)
     submission.to_csv(save_path, sep=',', index=False, header=True)
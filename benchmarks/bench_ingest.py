@@ -0,0 +1,154 @@
+"""
+DICOM 读取性能基准：用 pydicom 生成合成 CT 序列，不需要真实病人数据。
+分别计时 get_dcm_numpy_with_z、interface.get_dcm_numpy、convert_dcm_to_mhd、utils.util.load_dicom_image，
+输出 files/s、MB/s 以及峰值 RSS。每个读取函数都在单独的子进程中运行，峰值内存互不影响。
+
+示例：
+    python benchmarks/bench_ingest.py --slices 300 --matrix 512 --spacing 2.5 0.7 0.7 --extra-series 1
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import importlib.util
+import multiprocessing
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+PIPELINE_DIR = os.path.join(ROOT, "Nodule_net_pipeline")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_dicom import make_series_folder
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB），平台不支持时返回 None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 以 KB 为单位，macOS 以字节为单位
+        return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1024 ** 2
+    except ImportError:
+        return None
+
+
+def load_module_from_file(name, path):
+    """Nodule_net_pipeline/utils 与根目录的 utils 同名，按文件路径加载模块"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# 每个 prepare_* 负责导入（不计入耗时），返回真正被计时的函数 run(folder)
+
+def prepare_get_dcm_numpy_with_z():
+    from utils.read_file import get_dcm_numpy_with_z
+
+    def run(folder):
+        paths = [os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(".dcm")]
+        get_dcm_numpy_with_z(paths)
+    return run
+
+
+def prepare_get_dcm_numpy():
+    from interface import get_dcm_numpy
+
+    def run(folder):
+        result = get_dcm_numpy(folder, cache=None)
+        if isinstance(result, str):
+            raise RuntimeError(result)
+    return run
+
+
+def prepare_convert_dcm_to_mhd():
+    dcm_to_mhd = load_module_from_file("dcm_to_mhd", os.path.join(PIPELINE_DIR, "dcm_to_mhd.py"))
+
+    def run(folder):
+        with tempfile.TemporaryDirectory() as out_dir:
+            dcm_to_mhd.convert_dcm_to_mhd(folder, os.path.join(out_dir, "bench.mhd"))
+    return run
+
+
+def prepare_load_dicom_image():
+    # utils/util.py 通过 "from config import config" 导入配置，需要 Nodule_net_pipeline 在 sys.path 中
+    sys.path.insert(0, PIPELINE_DIR)
+    util = load_module_from_file("nodule_util", os.path.join(PIPELINE_DIR, "utils", "util.py"))
+    return util.load_dicom_image
+
+
+LOADERS = {
+    "get_dcm_numpy_with_z": prepare_get_dcm_numpy_with_z,
+    "interface.get_dcm_numpy": prepare_get_dcm_numpy,
+    "convert_dcm_to_mhd": prepare_convert_dcm_to_mhd,
+    "utils.util.load_dicom_image": prepare_load_dicom_image,
+}
+
+
+def bench_in_child(args):
+    """在子进程中执行一次读取，返回 (耗时秒数, 峰值 RSS MB, 错误信息)"""
+    name, folder = args
+    os.chdir(tempfile.gettempdir())  # interface 会写 ./temp，不污染仓库
+    try:
+        run = LOADERS[name]()
+        start = time.perf_counter()
+        run(folder)
+    except Exception as e:
+        return None, peak_rss_mb(), f"{type(e).__name__}: {e}"
+    return time.perf_counter() - start, peak_rss_mb(), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成 DICOM 序列读取性能基准")
+    parser.add_argument("--slices", type=int, default=300, help="层数")
+    parser.add_argument("--matrix", type=int, default=512, help="每层的行列数")
+    parser.add_argument("--spacing", type=float, nargs=3, default=[2.5, 0.7, 0.7], help="z y x spacing (mm)")
+    parser.add_argument("--extra-series", type=int, default=0, help="同一文件夹中额外放入的 CR 序列个数")
+    parser.add_argument("--no-shuffle", action="store_true", help="文件名按层的顺序命名")
+    parser.add_argument("--repeat", type=int, default=3, help="每个读取函数重复次数，取最快的一次")
+    parser.add_argument("--loaders", nargs="*", default=list(LOADERS), choices=list(LOADERS))
+    parser.add_argument("--workdir", default=None, help="生成数据的目录，默认使用临时目录并在结束后删除")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_ingest_")
+    folder = os.path.join(workdir, "series")
+    try:
+        print(f"生成合成序列：{args.slices} 层，{args.matrix}x{args.matrix}，spacing {args.spacing}，"
+              f"额外序列 {args.extra_series} 个 -> {folder}")
+        if not os.path.isdir(folder):
+            make_series_folder(folder, args.slices, args.matrix, tuple(args.spacing),
+                               shuffle=not args.no_shuffle, extra_series=args.extra_series)
+        files = [os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(".dcm")]
+        total_mb = sum(os.path.getsize(f) for f in files) / 1024 ** 2
+        print(f"共 {len(files)} 个文件，{total_mb:.1f} MB\n")
+
+        print(f"{'loader':<30}{'best s':>10}{'files/s':>12}{'MB/s':>10}{'peak RSS MB':>14}")
+        context = multiprocessing.get_context("spawn")
+        for name in args.loaders:
+            results = []
+            for _ in range(args.repeat):
+                with context.Pool(1) as pool:
+                    results.append(pool.apply(bench_in_child, ((name, folder),)))
+            errors = [error for _, _, error in results if error]
+            if errors:
+                print(f"{name:<30}  跳过：{errors[0]}")
+                continue
+            best = min(seconds for seconds, _, _ in results)
+            peak = max((rss for _, rss, _ in results if rss is not None), default=None)
+            peak_text = f"{peak:.0f}" if peak is not None else "n/a"
+            print(f"{name:<30}{best:>10.3f}{len(files) / best:>12.1f}{total_mb / best:>10.1f}{peak_text:>14}")
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
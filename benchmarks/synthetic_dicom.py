@@ -0,0 +1,107 @@
+import os
+import random
+import numpy as np
+import pydicom
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, CTImageStorage, generate_uid
+from typing import List, Tuple, Optional
+
+
+def make_phantom_volume(shape: Tuple[int, int, int], spacing: Tuple[float, float, float]) -> np.ndarray:
+    """
+    生成一个简单的胸部 CT 体模（HU，int16，[z, y, x]）：
+    空气 -1000，体部椭圆 40，体内左右两个肺（-850），上下两端肺逐渐变小，中间一根气管（-950）。
+    """
+    depth, height, width = shape
+    z = (np.arange(depth) + 0.5) / depth - 0.5
+    y = (np.arange(height) - height / 2 + 0.5) * spacing[1]
+    x = (np.arange(width) - width / 2 + 0.5) * spacing[2]
+    yy, xx = np.meshgrid(y, x, indexing="ij")
+
+    # 体部尺寸按物理大小给出，约 320mm x 230mm
+    half_w, half_h = min(160.0, x[-1] * 0.9), min(115.0, y[-1] * 0.9)
+    body = (xx / half_w) ** 2 + (yy / half_h) ** 2 < 1
+    trachea = (xx / 9.0) ** 2 + ((yy + half_h * 0.35) / 9.0) ** 2 < 1
+
+    volume = np.full(shape, -1000, dtype=np.int16)
+    for i in range(depth):
+        # 肺在 z 方向上中间最大，两端缩小
+        scale = max(0.0, 1.0 - (2 * z[i]) ** 4)
+        lung_w, lung_h = half_w * 0.35 * scale, half_h * 0.6 * scale
+        img = np.where(body, 40, -1000).astype(np.int16)
+        if scale > 0:
+            for cx in (-half_w * 0.45, half_w * 0.45):
+                lung = ((xx - cx) / lung_w) ** 2 + (yy / lung_h) ** 2 < 1
+                img[lung] = -850
+        if z[i] < 0.35:
+            img[trachea & body] = -950
+        volume[i] = img
+    return volume
+
+
+def write_series(folder: str, volume: np.ndarray, spacing: Tuple[float, float, float],
+                 modality: str = "CT", shuffle: bool = True, prefix: str = "",
+                 seed: Optional[int] = None) -> List[str]:
+    """
+    把 [z, y, x] 的 HU 体数据写成一个 DICOM 序列（每层一个文件，RescaleIntercept=-1024）。
+    shuffle 为 True 时文件名与层的顺序无关，模拟 LIDC 中文件名与 InstanceNumber 不对应的情况。
+    返回写出的文件路径。
+    """
+    os.makedirs(folder, exist_ok=True)
+    study_uid, series_uid = generate_uid(), generate_uid()
+    order = list(range(volume.shape[0]))
+    if shuffle:
+        random.Random(seed).shuffle(order)
+
+    paths = []
+    for file_index, slice_index in enumerate(order):
+        sop_uid = generate_uid()
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = CTImageStorage
+        meta.MediaStorageSOPInstanceUID = sop_uid
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+        ds = FileDataset(None, {}, file_meta=meta, preamble=b"\0" * 128)
+        ds.SOPClassUID = CTImageStorage
+        ds.SOPInstanceUID = sop_uid
+        ds.StudyInstanceUID = study_uid
+        ds.SeriesInstanceUID = series_uid
+        ds.Modality = modality
+        ds.PatientID = "SYNTHETIC"
+        ds.InstanceNumber = slice_index + 1
+        ds.ImagePositionPatient = [-volume.shape[2] * spacing[2] / 2, -volume.shape[1] * spacing[1] / 2,
+                                   -200.0 + slice_index * spacing[0]]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelSpacing = [spacing[1], spacing[2]]
+        ds.SliceThickness = spacing[0]
+        ds.Rows, ds.Columns = volume.shape[1], volume.shape[2]
+        ds.BitsAllocated = 16
+        ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 1
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.RescaleSlope = 1
+        ds.RescaleIntercept = -1024
+        ds.PixelData = (volume[slice_index].astype(np.int32) + 1024).astype(np.int16).tobytes()
+
+        path = os.path.join(folder, f"{prefix}{file_index:06d}.dcm")
+        ds.save_as(path, enforce_file_format=True)
+        paths.append(path)
+    return paths
+
+
+def make_series_folder(folder: str, n_slices: int = 300, matrix: int = 512,
+                       spacing: Tuple[float, float, float] = (2.5, 0.7, 0.7), shuffle: bool = True,
+                       extra_series: int = 0, extra_slices: int = 3, seed: int = 0) -> List[str]:
+    """
+    在 folder 中生成一个 n_slices 层、matrix x matrix 的 CT 序列。
+    extra_series > 0 时再放入若干个 extra_slices 层的 CR 序列，模拟一个文件夹中有多个序列的情况。
+    返回主序列的文件路径。
+    """
+    volume = make_phantom_volume((n_slices, matrix, matrix), spacing)
+    paths = write_series(folder, volume, spacing, shuffle=shuffle, seed=seed)
+    for k in range(extra_series):
+        scout = make_phantom_volume((extra_slices, matrix, matrix), spacing)
+        write_series(folder, scout, spacing, modality="CR", shuffle=shuffle, prefix=f"extra{k}_", seed=seed + k + 1)
+    return paths
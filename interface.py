@@ -1,78 +1,135 @@
-from utils.read_file import get_dcm_numpy_with_z
+from utils.read_file import get_dcm_volume_with_z
+from utils.volume_cache import VolumeCache
+from utils.volume import DcmVolume
+from utils.lazy_volume import LazyDcmVolume
+from utils.resample import output_length, axis_coordinates, linear_resample
 import os
 import numpy as np
 import pydicom
 from matplotlib import pyplot as plt
-from typing import Tuple,List
-from scipy.ndimage import zoom
+from typing import Tuple,List,Dict,Optional,Union,Sequence
 
-def get_dcm_numpy(path: str) -> Tuple[str,List[dict]]:
+# 默认的磁盘缓存，可直接修改 default_cache.max_bytes 调整磁盘预算
+default_cache = VolumeCache("./temp/cache")
+
+def get_dcm_volume(path: str, cache: Optional[VolumeCache] = None) -> DcmVolume:
+    """
+    输入文件路径或文件夹路径，返回内存中的 DcmVolume，不经过磁盘。
+    如果是文件夹，会按 z 坐标排序并堆叠为 3D 数组；如果是单个文件，返回 2D 数组。
+    持久化是可选的：给出 cache 时，文件夹的结果会存入缓存，命中时返回内存映射数组。
+    路径不存在或没有 dcm 文件时抛出 FileNotFoundError。
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError("path not exists")
+
+    if os.path.isdir(path):
+        # 收集所有 .dcm 文件路径
+        paths = [os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(".dcm")]
+        if not paths:
+            raise FileNotFoundError("no dcm files found")
+
+        # 缓存命中时直接返回缓存中的数组
+        key = None
+        if cache is not None:
+            key = cache.series_key(paths)
+            infos = cache.load_info(key)
+            if infos is not None and cache.contains(key, "raw"):
+                return DcmVolume(cache.load(key, "raw"), infos, cache_key=key)
+
+        # 并行读取头信息、按 z 排序，再并行解码到预分配的数组中
+        img_stack, infos = get_dcm_volume_with_z(paths)  # shape: [z, y, x]
+
+        if cache is not None:
+            cache.save_info(key, infos)
+            cache.save(key, "raw", img_stack)
+        return DcmVolume(img_stack, infos, cache_key=key)
+
+    ds = pydicom.dcmread(path)
+    return DcmVolume(ds.pixel_array, [{"PixelSpaceYX":ds.PixelSpacing}])
+
+def get_dcm_lazy_volume(path: str, max_bytes: int = 256 * 1024 ** 2, prefetch: int = 2) -> LazyDcmVolume:
+    """
+    输入文件夹路径，返回按需解码的 LazyDcmVolume，供 GUI 浏览使用。
+    只读取头信息，第一次访问某一层时才解码，首张图像的等待时间与层数基本无关。
+    max_bytes 为已解码层的缓存上限，prefetch 为后台预取的相邻层数。
+    """
+    if not os.path.isdir(path):
+        raise FileNotFoundError("path not exists")
+    paths = [os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(".dcm")]
+    if not paths:
+        raise FileNotFoundError("no dcm files found")
+    return LazyDcmVolume(paths, max_bytes=max_bytes, prefetch=prefetch)
+
+def get_dcm_numpy(path: str, cache: Optional[VolumeCache] = default_cache) -> Tuple[str,List[dict]]:
     """
     输入文件路径或文件夹路径，返回 numpy 数组保存路径。
     如果是文件夹，会按 z 坐标排序并堆叠为 3D 数组。
     此外，返回一个list，保存全部层的{"z":z,"PixelSpaceYX":ds.PixelSpacing}。如果是单层，则没有z属性。
+    文件夹的结果会存入 cache（以 SeriesInstanceUID + 文件大小/mtime 为键），命中时不再解码 DICOM；
+    cache 为 None 时与以前一样写到 ./temp/dcm_3d.npy。
+    不需要落盘时请直接使用 get_dcm_volume。
     """
     if not os.path.exists(path):
         return "path not exists"
 
     try:
-        if os.path.isdir(path):
-            # 收集所有 .dcm 文件路径
-            paths = [os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(".dcm")]
-            if not paths:
-                return "no dcm files found"
-
-            # 读取所有 DICOM 并排序
-            imgs_with_info = get_dcm_numpy_with_z(paths)
-            imgs_with_info.sort(key=lambda x: x[1]["z"])
-
-            # 提取排序后的图像
-            img_stack = np.stack([item[0] for item in imgs_with_info], axis=0)  # shape: [z, y, x]
-
-            # 保存为 numpy 文件
-            os.makedirs("./temp", exist_ok=True)
-            save_path = os.path.join("./temp", "dcm_3d.npy")
-            np.save(save_path, img_stack)
-
-            return save_path,[info[1] for info in imgs_with_info]
-
-        elif os.path.isfile(path):
-            ds = pydicom.dcmread(path)
-            img = ds.pixel_array
-            spacing = ds.PixelSpacing
-            os.makedirs("./temp", exist_ok=True)
-            save_path = os.path.join("./temp", "dcm_2d.npy")
-            np.save(save_path, img)
-            return save_path,[{"PixelSpaceYX":spacing}]
-
+        if os.path.isdir(path) or os.path.isfile(path):
+            volume = get_dcm_volume(path, cache)
         else:
             return "invalid path"
 
+        if volume.cache_key is not None:
+            return cache.path(volume.cache_key, "raw"),volume.infos
+
+        # 保存为 numpy 文件
+        os.makedirs("./temp", exist_ok=True)
+        save_path = os.path.join("./temp", "dcm_3d.npy" if volume.ndim == 3 else "dcm_2d.npy")
+        return volume.save(save_path),volume.infos
+
+    except FileNotFoundError as e:
+        return str(e)
     except Exception as e:
         return f"failed: {e}"
 
-import numpy as np
-import os
-from typing import Tuple, List, Dict
+def resampled_cache_name(target_spacing: Sequence[float], dtype) -> str:
+    """重采样结果在缓存中的名字，包含目标 spacing 和数据类型，如 resampled_1x1x1mm_float32"""
+    spacing_text = "x".join(f"{float(s):g}" for s in target_spacing)
+    return f"resampled_{spacing_text}mm_{np.dtype(dtype).name}"
 
-def convert_to_mm_physical_space(
-    numpy_path: str, 
-    info_list: List[Dict]
-) -> str:
-    """
-    将 DICOM 图像转换为以毫米为单位的物理空间，即进行实际的重采样。
-    
-    参数:
-        numpy_path (str): 输入的 numpy 文件路径
-        info_list (List[Dict]): 包含 PixelSpacing 和 z 坐标（如果是 3D）的信息列表
+def _target_spacing(target_spacing: Union[None, float, Sequence[float]], ndim: int) -> List[float]:
+    """None 表示 1mm；单个数表示各轴相同"""
+    if target_spacing is None:
+        target_spacing = 1.0
+    if np.isscalar(target_spacing):
+        return [float(target_spacing)] * ndim
+    assert len(target_spacing) == ndim, f"target_spacing 应有 {ndim} 个值，实际为 {len(target_spacing)} 个"
+    return [float(s) for s in target_spacing]
 
-    返回:
-        str: 重采样后 numpy 文件的保存路径
+def convert_volume_to_mm(
+    volume: DcmVolume,
+    cache: Optional[VolumeCache] = None,
+    target_spacing: Union[None, float, Sequence[float]] = None,
+    dtype=np.float32,
+    out_path: Optional[str] = None
+) -> DcmVolume:
+    """
+    将 DcmVolume 转换为以毫米为单位的物理空间，即进行实际的重采样（线性插值）。
+    target_spacing: 目标 spacing（mm），默认 1mm，可以是单个数或与维度相同的列表，如粗略预览时用 2。
+    dtype: 输出的数据类型，默认 float32；整数类型会四舍五入并裁剪到取值范围。
+    重采样按 z 分块以 float32 计算，层间距不均匀时按各层的实际 z 坐标插值。
+    如果 volume 来自 cache，结果直接写入同一缓存条目（内存映射），命中时直接返回内存映射数组；
+    否则 out_path 给出时直接写入该 .npy 文件，都不给出时结果保留在内存中。
     """
-    # 1. 读取 numpy
-    img = np.load(numpy_path)
+    img = volume.array
+    info_list = volume.infos
+    target_spacing = _target_spacing(target_spacing, img.ndim)
+
+    cache_name = resampled_cache_name(target_spacing, dtype)
+    key = volume.cache_key if cache is not None else None
+    if key is not None and cache.contains(key, cache_name):
+        return DcmVolume(cache.load(key, cache_name), spacing=target_spacing, cache_key=key)
 
-    # 2. 检查层数与 info_list 一致
+    # 1. 检查层数与 info_list 一致
     if img.ndim == 3:
         assert img.shape[0] == len(info_list), \
             f"层数不匹配: numpy 有 {img.shape[0]} 层，但 info_list 有 {len(info_list)} 项"
@@ -82,7 +139,7 @@ def convert_to_mm_physical_space(
     else:
         raise ValueError("只支持 2D 或 3D numpy 图像")
 
-    # 3. 计算缩放因子
+    # 2. 计算输出形状和每个输出体素在输入中的坐标
     if img.ndim == 3:
         # 获取 spacing
         pixel_spacings = [info["PixelSpaceYX"] for info in info_list]
@@ -93,44 +150,81 @@ def convert_to_mm_physical_space(
         for spacing in pixel_spacings:
             assert spacing == first_spacing, "所有层的 PixelSpacing 必须相同"
 
-        y_spacing, x_spacing = first_spacing
-        z_diffs = np.diff(z_coords)
-        z_spacing = float(np.mean(z_diffs))
+        y_spacing, x_spacing = (float(s) for s in first_spacing)
+        z_spacing = abs(volume.spacing[0])
 
-        # 原 spacing：[z_spacing, y_spacing, x_spacing]
-        # 我们希望变为 1mm spacing，也可改为其他目标 spacing
-        target_spacing = [1.0, 1.0, 1.0]  # 可调
-        zoom_factors = [
-            z_spacing / target_spacing[0],
-            y_spacing / target_spacing[1],
-            x_spacing / target_spacing[2]
-        ]
+        out_shape = (output_length(img.shape[0], z_spacing, target_spacing[0]),
+                     output_length(img.shape[1], y_spacing, target_spacing[1]),
+                     output_length(img.shape[2], x_spacing, target_spacing[2]))
+        # z 方向按各层实际的 z 坐标插值，层间距不均匀时不会被平均掉
+        coords = [axis_coordinates(img.shape[0], out_shape[0], z_coords),
+                  axis_coordinates(img.shape[1], out_shape[1]),
+                  axis_coordinates(img.shape[2], out_shape[2])]
 
         print(f"[3D] 原始 spacing: {[z_spacing, y_spacing, x_spacing]}")
-        print(f"[3D] zoom_factors: {zoom_factors}")
-
-        resampled_img = zoom(img, zoom=zoom_factors, order=1)  # 使用线性插值
+        print(f"[3D] 目标 spacing: {target_spacing}，输出形状: {out_shape}")
 
     else:
         # 2D 图像
-        y_spacing, x_spacing = info_list[0]["PixelSpaceYX"]
+        y_spacing, x_spacing = (float(s) for s in info_list[0]["PixelSpaceYX"])
 
-        target_spacing = [1.0, 1.0]  # 目标单位为 1mm
-        zoom_factors = [
-            y_spacing / target_spacing[0],
-            x_spacing / target_spacing[1]
-        ]
+        out_shape = (output_length(img.shape[0], y_spacing, target_spacing[0]),
+                     output_length(img.shape[1], x_spacing, target_spacing[1]))
+        coords = [axis_coordinates(img.shape[0], out_shape[0]),
+                  axis_coordinates(img.shape[1], out_shape[1])]
 
         print(f"[2D] 原始 spacing: {[y_spacing, x_spacing]}")
-        print(f"[2D] zoom_factors: {zoom_factors}")
+        print(f"[2D] 目标 spacing: {target_spacing}，输出形状: {out_shape}")
+
+    def fill(out):
+        linear_resample(img, coords, out=out)
+
+    # 3. 来自缓存的体数据直接写入缓存，给出 out_path 时直接写入该文件
+    if key is not None:
+        cache.save_with(key, cache_name, out_shape, dtype, fill)
+        resampled_img = cache.load(key, cache_name)
+    elif out_path is not None:
+        resampled_img = np.lib.format.open_memmap(out_path, mode="w+", dtype=dtype, shape=out_shape)
+        fill(resampled_img)
+        resampled_img.flush()
+    else:
+        resampled_img = linear_resample(img, coords, dtype=dtype)
+    return DcmVolume(resampled_img, spacing=target_spacing, cache_key=key)
+
+def convert_to_mm_physical_space(
+    numpy_path: str, 
+    info_list: List[Dict],
+    cache: Optional[VolumeCache] = default_cache,
+    target_spacing: Union[None, float, Sequence[float]] = None,
+    dtype=np.float32
+) -> str:
+    """
+    将 DICOM 图像转换为以毫米为单位的物理空间，即进行实际的重采样。
+    
+    参数:
+        numpy_path (str): 输入的 numpy 文件路径
+        info_list (List[Dict]): 包含 PixelSpacing 和 z 坐标（如果是 3D）的信息列表
+        cache (VolumeCache): 如果 numpy_path 来自该缓存，重采样结果也存入同一缓存条目，命中时直接返回
+        target_spacing: 目标 spacing（mm），默认 1mm，可以是单个数或与维度相同的列表
+        dtype: 输出的数据类型，默认 float32
 
-        resampled_img = zoom(img, zoom=zoom_factors, order=1)
+    返回:
+        str: 重采样后 numpy 文件的保存路径
+    """
+    img = np.load(numpy_path, mmap_mode="r")
+    cache_name = resampled_cache_name(_target_spacing(target_spacing, img.ndim), dtype)
+    key = cache.key_of(numpy_path) if cache is not None else None
+    if key is not None and cache.contains(key, cache_name):
+        cache.touch(key)
+        return cache.path(key, cache_name)
 
-    # 4. 保存
+    # 输入以内存映射读取，结果直接写入 .npy 文件，内存占用只与分块大小有关
+    if key is not None:
+        convert_volume_to_mm(DcmVolume(img, info_list, cache_key=key), cache, target_spacing, dtype)
+        return cache.path(key, cache_name)
     os.makedirs("./temp", exist_ok=True)
     save_path = os.path.join("./temp", "dcm_resampled_mm.npy")
-    np.save(save_path, resampled_img.astype(np.float32))
-
+    convert_volume_to_mm(DcmVolume(img, info_list), None, target_spacing, dtype, out_path=save_path)
     return save_path
 
 
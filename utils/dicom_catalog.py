@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import pydicom
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
+
+# 建目录时需要的 tag，只读头信息
+CATALOG_TAGS = ["SOPInstanceUID", "SeriesInstanceUID", "StudyInstanceUID", "Modality", "InstanceNumber",
+                "ImagePositionPatient", "PixelSpacing", "SliceThickness", "Rows", "Columns"]
+
+COLUMNS = ["path", "mtime_ns", "size", "sop_uid", "series_uid", "study_uid", "modality", "instance_number",
+           "z", "spacing_y", "spacing_x", "slice_thickness", "rows", "cols"]
+
+
+def _read_catalog_row(path: str, mtime_ns: int, size: int) -> tuple:
+    """
+    读取一个文件的头信息，返回一行记录。读不出来的文件也记录下来（除 path/mtime/size 外均为 NULL），
+    这样重新扫描时不会反复尝试。
+    """
+    try:
+        ds = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=CATALOG_TAGS)
+    except Exception:
+        return (path, mtime_ns, size) + (None,) * (len(COLUMNS) - 3)
+
+    def get(name, cast):
+        value = getattr(ds, name, None)
+        return cast(value) if value is not None and value != "" else None
+
+    position = getattr(ds, "ImagePositionPatient", None)
+    spacing = getattr(ds, "PixelSpacing", None)
+    return (path, mtime_ns, size,
+            get("SOPInstanceUID", str),
+            get("SeriesInstanceUID", str),
+            get("StudyInstanceUID", str),
+            get("Modality", str),
+            get("InstanceNumber", int),
+            float(position[2]) if position else None,
+            float(spacing[0]) if spacing else None,
+            float(spacing[1]) if spacing else None,
+            get("SliceThickness", float),
+            get("Rows", int),
+            get("Columns", int))
+
+
+class DicomCatalog(object):
+    """
+    基于 SQLite（标准库）的 DICOM 目录索引：SOPInstanceUID -> 文件、序列、InstanceNumber、z、spacing、mtime。
+    scan 是增量的，只读取新增或 mtime/大小发生变化的文件的头信息，并删除已不存在的文件的记录。
+    之后按 SOPInstanceUID、序列或文件夹的查找都是索引查询，不需要再遍历目录和读文件。
+    """
+
+    def __init__(self, db_path: str = "./temp/dicom_catalog.sqlite"):
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, "
+                          "mtime_ns INTEGER, size INTEGER, sop_uid TEXT, series_uid TEXT, study_uid TEXT, "
+                          "modality TEXT, instance_number INTEGER, z REAL, spacing_y REAL, spacing_x REAL, "
+                          "slice_thickness REAL, rows INTEGER, cols INTEGER)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_sop ON files (sop_uid)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_series ON files (series_uid)")
+        self.conn.commit()
+
+    @staticmethod
+    def _norm(path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    def _under(self, folder: str) -> Tuple[str, tuple]:
+        """
+        返回限定在 folder 下的 WHERE 子句及参数。
+        用 path 主键上的范围条件表示前缀匹配，可以走索引；chr(0x10FFFF) 是最大的字符，
+        以 prefix 开头的路径都小于 prefix + chr(0x10FFFF)。
+        """
+        prefix = os.path.join(self._norm(folder), "")
+        return "path >= ? AND path < ?", (prefix, prefix + chr(0x10FFFF))
+
+    def scan(self, root: str, suffix: str = ".dcm", max_workers: Optional[int] = None) -> Tuple[int, int]:
+        """
+        增量扫描 root 下所有以 suffix 结尾的文件。
+        返回 (重新读取头信息的文件数, 删除的记录数)。
+        """
+        on_disk = {}
+        for dirpath, _, files in os.walk(root):
+            for f in files:
+                if f.lower().endswith(suffix):
+                    path = self._norm(os.path.join(dirpath, f))
+                    st = os.stat(path)
+                    on_disk[path] = (st.st_mtime_ns, st.st_size)
+
+        where, params = self._under(root)
+        known = {row[0]: (row[1], row[2]) for row in
+                 self.conn.execute(f"SELECT path, mtime_ns, size FROM files WHERE {where}", params)}
+
+        changed = [(path, mtime_ns, size) for path, (mtime_ns, size) in on_disk.items()
+                   if known.get(path) != (mtime_ns, size)]
+        removed = [(path,) for path in known if path not in on_disk]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            rows = list(executor.map(lambda args: _read_catalog_row(*args), changed))
+
+        placeholders = ", ".join("?" * len(COLUMNS))
+        self.conn.executemany(f"INSERT OR REPLACE INTO files ({', '.join(COLUMNS)}) VALUES ({placeholders})", rows)
+        self.conn.executemany("DELETE FROM files WHERE path = ?", removed)
+        self.conn.commit()
+        return len(rows), len(removed)
+
+    def path_of(self, sop_uid: str, folder: Optional[str] = None) -> Optional[str]:
+        """SOPInstanceUID -> 文件路径，folder 给出时只在该文件夹下查找"""
+        sql, params = "SELECT path FROM files WHERE sop_uid = ?", (sop_uid,)
+        if folder is not None:
+            where, folder_params = self._under(folder)
+            sql, params = sql + f" AND {where}", params + folder_params
+        row = self.conn.execute(sql, params).fetchone()
+        return row[0] if row else None
+
+    def sop_to_filename(self, folder: str) -> Dict[str, str]:
+        """folder 下所有文件的 {SOPInstanceUID: 文件名}"""
+        where, params = self._under(folder)
+        rows = self.conn.execute(f"SELECT sop_uid, path FROM files WHERE sop_uid IS NOT NULL AND {where}", params)
+        return {sop_uid: os.path.basename(path) for sop_uid, path in rows}
+
+    def series_in(self, folder: str) -> List[Dict]:
+        """
+        folder 下的所有序列，按层数从多到少排序：
+        [{"series_uid","modality","count","folder"}]，folder 为该序列文件所在的文件夹。
+        """
+        where, params = self._under(folder)
+        rows = self.conn.execute(f"SELECT series_uid, modality, COUNT(*), MIN(path) FROM files "
+                                 f"WHERE series_uid IS NOT NULL AND {where} "
+                                 f"GROUP BY series_uid ORDER BY COUNT(*) DESC", params)
+        return [{"series_uid": series_uid, "modality": modality, "count": count, "folder": os.path.dirname(path)}
+                for series_uid, modality, count, path in rows]
+
+    def series_files(self, series_uid: str) -> List[Dict]:
+        """一个序列的所有文件，按 z 排序：[{"path","z","instance_number","PixelSpaceYX"}]"""
+        rows = self.conn.execute("SELECT path, z, instance_number, spacing_y, spacing_x FROM files "
+                                 "WHERE series_uid = ? ORDER BY z, instance_number", (series_uid,))
+        return [{"path": path, "z": z, "instance_number": instance_number, "PixelSpaceYX": [spacing_y, spacing_x]}
+                for path, z, instance_number, spacing_y, spacing_x in rows]
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
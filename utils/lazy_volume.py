@@ -0,0 +1,104 @@
+import threading
+import numpy as np
+import pydicom
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+
+from utils.read_file import read_dcm_headers
+
+
+class LazyDcmVolume(object):
+    """
+    按需解码的 DICOM 序列，用于 GUI 浏览。
+    构造时只读取头信息并按 z 排序，某一层第一次被访问时才解码像素。
+    已解码的层保存在 LRU 缓存中，总字节数不超过 max_bytes；
+    每次访问后，后台线程会预取前后各 prefetch 层。
+    """
+
+    def __init__(self, paths: List[str], max_bytes: int = 256 * 1024 ** 2, prefetch: int = 2,
+                 max_workers: Optional[int] = None):
+        self.headers = read_dcm_headers(paths, max_workers)
+        self.max_bytes = max_bytes
+        self.prefetch = prefetch
+
+        self._cache = OrderedDict()  # 层号 -> 解码后的 2D 数组
+        self._cache_bytes = 0
+        self._pending = set()  # 已提交预取、尚未完成的层号
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def __len__(self) -> int:
+        return len(self.headers)
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self.headers),) + self.headers[0]["shape"]
+
+    @property
+    def infos(self) -> List[Dict]:
+        """与 get_dcm_numpy 返回的 info 列表相同：{"z":z,"PixelSpaceYX":spacing}"""
+        return [{"z":header["z"],"PixelSpaceYX":header["PixelSpaceYX"]} for header in self.headers]
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        """返回第 index 层（按 z 排序）的 2D 数组，并在后台预取相邻层"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"层号越界: {index}，共 {len(self)} 层")
+
+        img = self._get_cached(index)
+        if img is None:
+            img = self._decode(index)
+            self._put(index, img)
+
+        self._schedule_prefetch(index)
+        return img
+
+    def _get_cached(self, index: int) -> Optional[np.ndarray]:
+        with self._lock:
+            img = self._cache.get(index)
+            if img is not None:
+                self._cache.move_to_end(index)
+            return img
+
+    def _decode(self, index: int) -> np.ndarray:
+        return pydicom.dcmread(self.headers[index]["path"]).pixel_array
+
+    def _put(self, index: int, img: np.ndarray) -> None:
+        with self._lock:
+            if index in self._cache:
+                return
+            self._cache[index] = img
+            self._cache_bytes += img.nbytes
+            # 超出预算时淘汰最久未访问的层，但至少保留刚放入的这一层
+            while self._cache_bytes > self.max_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= evicted.nbytes
+
+    def _schedule_prefetch(self, index: int) -> None:
+        for offset in range(1, self.prefetch + 1):
+            for neighbour in (index + offset, index - offset):
+                if not 0 <= neighbour < len(self):
+                    continue
+                with self._lock:
+                    if neighbour in self._cache or neighbour in self._pending:
+                        continue
+                    self._pending.add(neighbour)
+                self._executor.submit(self._prefetch_one, neighbour)
+
+    def _prefetch_one(self, index: int) -> None:
+        try:
+            self._put(index, self._decode(index))
+        finally:
+            with self._lock:
+                self._pending.discard(index)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
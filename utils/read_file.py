@@ -1,7 +1,11 @@
 import pydicom
 import matplotlib.pyplot as plt
 import numpy as np
-from typing import NoReturn
+from typing import NoReturn, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+# 只读头信息时需要的 tag，避免解析整个数据集
+HEADER_TAGS = ["ImagePositionPatient", "PixelSpacing", "Rows", "Columns"]
 
 
 def get_dcm_numpy_with_z(paths:list[str])->list[tuple[np.ndarray,dict]]:
@@ -19,6 +23,52 @@ def get_dcm_numpy_with_z(paths:list[str])->list[tuple[np.ndarray,dict]]:
         imgs.append((ds.pixel_array,info))
     return imgs
 
+def read_dcm_header(path:str)->dict:
+    """
+    只读取单个 DICOM 的头信息（不解码像素），返回 {"path","z","PixelSpaceYX","shape"}。
+    """
+    ds = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=HEADER_TAGS)
+    return {"path":path,
+            "z":float(ds.ImagePositionPatient[2]),
+            "PixelSpaceYX":ds.PixelSpacing,
+            "shape":(int(ds.Rows), int(ds.Columns))}
+
+def read_dcm_headers(paths:list[str], max_workers:Optional[int]=None)->list[dict]:
+    """
+    用线程池并行读取多个 DICOM 的头信息，并按 z 坐标排序后返回。
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        headers = list(executor.map(read_dcm_header, paths))
+    headers.sort(key=lambda x: x["z"])
+    return headers
+
+def get_dcm_volume_with_z(paths:list[str], max_workers:Optional[int]=None)->tuple[np.ndarray,list[dict]]:
+    """
+    先并行读取头信息并按 z 排序，再并行解码像素，直接写入预先分配好的 [z, y, x] 数组。
+    与 get_dcm_numpy_with_z + np.stack 相比，整个体数据在内存中只存在一份。
+    返回 (volume, info列表)，info 与 get_dcm_numpy_with_z 相同：{"z":z,"PixelSpaceYX":spacing}。
+    """
+    headers = read_dcm_headers(paths, max_workers)
+    shape = headers[0]["shape"]
+    for header in headers:
+        if header["shape"] != shape:
+            raise ValueError(f"各层尺寸不一致: {header['path']} 为 {header['shape']}，第一层为 {shape}")
+
+    # 先解码第一层，用它的 dtype 分配整个体数据
+    first = pydicom.dcmread(headers[0]["path"]).pixel_array
+    volume = np.empty((len(headers),) + shape, dtype=first.dtype)
+    volume[0] = first
+
+    def decode(i):
+        volume[i] = pydicom.dcmread(headers[i]["path"]).pixel_array
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() 让子线程中的异常在这里抛出
+        list(executor.map(decode, range(1, len(headers))))
+
+    infos = [{"z":header["z"],"PixelSpaceYX":header["PixelSpaceYX"]} for header in headers]
+    return volume, infos
+
 def plt_show_dcm_numpy(array:np.ndarray)->NoReturn:
     """
     显示灰度图。
@@ -0,0 +1,88 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+
+def output_length(length: int, spacing: float, target: float) -> int:
+    """与 scipy.ndimage.zoom(zoom=spacing/target) 相同的输出长度"""
+    return max(1, int(round(length * spacing / target)))
+
+
+def axis_coordinates(length: int, out_length: int, positions: Optional[Sequence[float]] = None) -> np.ndarray:
+    """
+    每个输出体素在输入中的（小数）下标，首尾两个体素对齐，与 zoom 的坐标映射相同。
+    positions 给出时（如各层的 z 坐标），输出在物理坐标上均匀分布，再按实际位置反查下标，
+    层间距不均匀时不会被平均掉；间距均匀时结果与不给 positions 相同。
+    """
+    if out_length <= 1 or length <= 1:
+        return np.zeros(out_length)
+    if positions is None:
+        return np.arange(out_length) * ((length - 1) / (out_length - 1))
+
+    positions = np.asarray(positions, dtype=np.float64)
+    if positions[-1] < positions[0]:
+        positions = -positions
+    out_positions = np.linspace(positions[0], positions[-1], out_length)
+    return np.interp(out_positions, positions, np.arange(length))
+
+
+def _linear_taps(coords: np.ndarray, length: int):
+    """线性插值的两个下标及第二个下标的权重，下标越界时取边缘（'nearest'）"""
+    low = np.clip(np.floor(coords).astype(np.int64), 0, length - 1)
+    high = np.minimum(low + 1, length - 1)
+    weight = (coords - low).astype(np.float32)
+    return low, high, weight
+
+
+def _cast(values: np.ndarray, dtype) -> np.ndarray:
+    """整数类型四舍五入并裁剪到取值范围，与 scipy.ndimage 的输出一致"""
+    dtype = np.dtype(dtype)
+    if dtype.kind in "iu":
+        info = np.iinfo(dtype)
+        values = np.clip(np.rint(values), info.min, info.max)
+    return values.astype(dtype, copy=False)
+
+
+def linear_resample(image: np.ndarray, coords: List[np.ndarray], out: Optional[np.ndarray] = None,
+                    dtype=np.float32, chunk_size: int = 16, max_workers: Optional[int] = None) -> np.ndarray:
+    """
+    可分离的线性插值重采样，支持 2D [y, x] 和 3D [z, y, x]。
+    coords 为每个轴上输出体素对应的输入下标（见 axis_coordinates）。
+    按输出的 z 分块，每块只读取需要的输入层（image 可以是内存映射），以 float32 计算后写入 out，
+    各块在线程池中并行。out 可以是 np.lib.format.open_memmap 打开的文件，此时内存占用只与块大小有关。
+    """
+    if image.ndim == 2:
+        out_2d = out[None] if out is not None else None
+        return linear_resample(image[None], [np.zeros(1)] + list(coords), out_2d, dtype,
+                               chunk_size, max_workers)[0]
+
+    out_shape = tuple(len(c) for c in coords)
+    if out is None:
+        out = np.empty(out_shape, dtype=dtype)
+    elif out.shape != out_shape:
+        raise ValueError(f"out 的形状 {out.shape} 与输出形状 {out_shape} 不一致")
+
+    z_low, z_high, z_weight = _linear_taps(coords[0], image.shape[0])
+    y_low, y_high, y_weight = _linear_taps(coords[1], image.shape[1])
+    x_low, x_high, x_weight = _linear_taps(coords[2], image.shape[2])
+
+    def run(start: int, stop: int) -> None:
+        # 只读取这一块用到的输入层
+        first, last = int(z_low[start:stop].min()), int(z_high[start:stop].max())
+        block = np.asarray(image[first:last + 1], dtype=np.float32)
+
+        w = z_weight[start:stop, None, None]
+        result = block[z_low[start:stop] - first] * (1 - w) + block[z_high[start:stop] - first] * w
+        w = y_weight[None, :, None]
+        result = result[:, y_low] * (1 - w) + result[:, y_high] * w
+        w = x_weight[None, None, :]
+        result = result[:, :, x_low] * (1 - w) + result[:, :, x_high] * w
+
+        out[start:stop] = _cast(result, out.dtype)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run, start, min(start + chunk_size, out_shape[0]))
+                   for start in range(0, out_shape[0], chunk_size)]
+        for future in futures:
+            future.result()
+    return out
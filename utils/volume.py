@@ -0,0 +1,40 @@
+import numpy as np
+from typing import List, Dict, Optional
+
+
+class DcmVolume(object):
+    """
+    在 interface.py 各阶段之间传递的内存中体数据。
+    array: [z, y, x]（3D）或 [y, x]（2D）的 numpy 数组，可以是 np.memmap，传递时不做复制
+    infos: 每层的 {"z":z,"PixelSpaceYX":spacing}，重采样之后为 None
+    spacing: 与 array 维度顺序一致的 spacing（mm），不给出时由 infos 推算
+    cache_key: 如果 array 来自 VolumeCache，对应的缓存键，否则为 None
+    """
+
+    def __init__(self, array: np.ndarray, infos: Optional[List[Dict]] = None,
+                 spacing: Optional[List[float]] = None, cache_key: Optional[str] = None):
+        self.array = array
+        self.infos = infos
+        self.cache_key = cache_key
+        self.spacing = list(spacing) if spacing is not None else self._spacing_from_infos()
+
+    def _spacing_from_infos(self) -> List[float]:
+        y_spacing, x_spacing = (float(s) for s in self.infos[0]["PixelSpaceYX"])
+        if self.array.ndim == 2:
+            return [y_spacing, x_spacing]
+        z_coords = [info["z"] for info in self.infos]
+        z_spacing = float(np.mean(np.diff(z_coords))) if len(z_coords) > 1 else 1.0
+        return [z_spacing, y_spacing, x_spacing]
+
+    @property
+    def ndim(self) -> int:
+        return self.array.ndim
+
+    @property
+    def shape(self) -> tuple:
+        return self.array.shape
+
+    def save(self, save_path: str) -> str:
+        """持久化是可选的：只有显式调用时才写盘"""
+        np.save(save_path, self.array)
+        return save_path
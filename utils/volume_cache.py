@@ -0,0 +1,146 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pydicom
+from typing import Optional, List, Dict
+
+
+class VolumeCache(object):
+    """
+    以内容为键的磁盘体数据缓存。
+    键由 SeriesInstanceUID 与全部文件的 (文件名, 大小, mtime) 计算得到，文件有任何改动都会得到新键。
+    每个键对应 cache_dir 下的一个文件夹，里面存放 raw.npy、重采样结果等 .npy 以及 info.json。
+    命中时以内存映射方式返回数组；总大小超过 max_bytes 时按最近访问时间（LRU）淘汰。
+    """
+
+    INFO_NAME = "info.json"
+
+    def __init__(self, cache_dir: str = "./temp/cache", max_bytes: int = 10 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def series_key(self, paths: List[str]) -> str:
+        """
+        计算一个序列的缓存键。只读取第一个文件的头信息，其余文件只做 stat。
+        """
+        ds = pydicom.dcmread(paths[0], stop_before_pixels=True, specific_tags=["SeriesInstanceUID"])
+        series_uid = str(getattr(ds, "SeriesInstanceUID", ""))
+
+        digest = hashlib.sha1(series_uid.encode("utf-8"))
+        for path in sorted(paths):
+            st = os.stat(path)
+            digest.update(f"{os.path.basename(path)}|{st.st_size}|{st.st_mtime_ns}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def path(self, key: str, name: str) -> str:
+        return os.path.join(self.entry_dir(key), name + ".npy")
+
+    def key_of(self, npy_path: str) -> Optional[str]:
+        """
+        如果 npy_path 位于缓存中，返回它所属的键，否则返回 None。
+        """
+        entry = os.path.dirname(os.path.abspath(npy_path))
+        if os.path.dirname(entry) != os.path.abspath(self.cache_dir):
+            return None
+        return os.path.basename(entry)
+
+    def contains(self, key: str, name: str) -> bool:
+        return os.path.isfile(self.path(key, name))
+
+    def touch(self, key: str) -> None:
+        """更新访问时间，用于 LRU 淘汰"""
+        os.utime(self.entry_dir(key), None)
+
+    def load(self, key: str, name: str) -> Optional[np.ndarray]:
+        """
+        命中时返回只读的内存映射数组，未命中返回 None。
+        """
+        if not self.contains(key, name):
+            return None
+        self.touch(key)
+        return np.load(self.path(key, name), mmap_mode="r")
+
+    def save(self, key: str, name: str, array: np.ndarray) -> str:
+        """
+        先写临时文件再原子替换，避免并发的研究读到写了一半的文件。返回 .npy 路径。
+        """
+        os.makedirs(self.entry_dir(key), exist_ok=True)
+        save_path = self.path(key, name)
+        tmp_path = save_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, save_path)
+        self.touch(key)
+        self.evict(keep=key)
+        return save_path
+
+    def save_with(self, key: str, name: str, shape: tuple, dtype, fill) -> str:
+        """
+        在缓存中新建 shape/dtype 的 .npy 内存映射（临时文件），调用 fill(out) 直接写入，
+        写完后原子替换为正式文件。结果直接落盘，内存中不必保留整个数组。返回 .npy 路径。
+        """
+        os.makedirs(self.entry_dir(key), exist_ok=True)
+        save_path = self.path(key, name)
+        tmp_path = save_path + f".{os.getpid()}.tmp"
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=shape)
+        try:
+            fill(out)
+            out.flush()
+        finally:
+            # 关闭映射后才能替换（Windows 上映射中的文件无法被替换）
+            del out
+        os.replace(tmp_path, save_path)
+        self.touch(key)
+        self.evict(keep=key)
+        return save_path
+
+    def load_info(self, key: str) -> Optional[List[Dict]]:
+        info_path = os.path.join(self.entry_dir(key), self.INFO_NAME)
+        if not os.path.isfile(info_path):
+            return None
+        with open(info_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_info(self, key: str, info_list: List[Dict]) -> None:
+        os.makedirs(self.entry_dir(key), exist_ok=True)
+        # PixelSpacing 等是 pydicom 的 MultiValue，先转成普通的 float 列表
+        serializable = [{k: ([float(x) for x in v] if k == "PixelSpaceYX" else v) for k, v in info.items()}
+                        for info in info_list]
+        info_path = os.path.join(self.entry_dir(key), self.INFO_NAME)
+        tmp_path = info_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(serializable, f)
+        os.replace(tmp_path, info_path)
+
+    def entry_size(self, key: str) -> int:
+        entry = self.entry_dir(key)
+        return sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """
+        总大小超过 max_bytes 时，从最久未访问的条目开始删除，keep 指定的条目不会被删除。
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            if os.path.isdir(self.entry_dir(key)):
+                entries.append((os.path.getmtime(self.entry_dir(key)), key, self.entry_size(key)))
+
+        total = sum(size for _, _, size in entries)
+        entries.sort()
+        for _, key, size in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+            total -= size
+
+    def clear(self) -> None:
+        shutil.rmtree(self.cache_dir, ignore_errors=True)